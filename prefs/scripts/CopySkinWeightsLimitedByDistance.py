@@ -6,39 +6,464 @@
 '''
 Custom skin copying script that skips vertices that aren't close to any others.
 Useful for skins on partial meshes to or from a whole mesh (or even another partial mesh).
+
+Each transfer is recorded on the target skinCluster (vertex positions and
+matched source vertices), so running the copy again only re-transfers the
+vertices that were moved since. Catching source weights repainted since is
+opt-in (checkRepaint), as it reads every source weight: the record then also
+holds a checksum of each source vertex's weights. Weights are read and written in bulk through the API, with
+writes made undoable through apiUndo. Large meshes can be processed in fixed
+size chunks to cap memory use, and cancelled with Esc between chunks.
+
+Also includes weight post-processing (max influences, pruning, normalization
+and removal of unused influences), run on the whole weight matrix at once.
 '''
 
+import itertools
+import zlib
+import numpy as np
 import maya.cmds as cmds
 import maya.mel as mel
+import maya.api.OpenMaya as om
+import maya.api.OpenMayaAnim as oma
+
+from jobScheduler import queueJob, background
+from apiUndo import undoableEdit
 
-def CopySkinWeightsLimitedByDistance(threshold = .01):
+'''
+Copies weights from the first selected object to the other selected objects.
+    threshold=[float] - Maximum distance between a target vertex and the source vertex it copies from. (default .01)
+    incremental=[bool] - Only re-transfer vertices that moved (or whose source vertex moved) since the last
+        transfer. (default True)
+    epsilon=[float] - Distance a vertex has to move to count as moved. (default 1e-5)
+    checkRepaint=[bool] - With incremental, also re-transfer vertices whose source vertex was repainted.
+        Reads all of the source's weights, so costs as much as a full transfer's read. (default False)
+    chunkSize=[int] - If provided, target vertices are matched and written this many at a time,
+        with progress shown in the main progress bar. Esc cancels between chunks. (default None)
+    maxInfluences, pruneBelow, removeUnused - If any are provided, targets are post-processed
+        after the copy. See postProcessSkinWeights.
+'''
+def CopySkinWeightsLimitedByDistance(threshold = .01, incremental = True, epsilon = 1e-5, chunkSize = None,
+                                     maxInfluences = None, pruneBelow = 0.0, removeUnused = False, checkRepaint = False):
     objs = cmds.ls(sl=1)
+    progress = mel.eval("$tmp = $gMainProgressBar") if chunkSize and not cmds.about(batch=1) else None
+    cancelled = False
     source = objs[0]
 
-    source_vertices = [cmds.xform(source+".vtx[%d]"%i, q=1, t=1, ws=0) for i in xrange(cmds.polyEvaluate(source, vertex=1))]
-    source_cluster = mel.eval('findRelatedSkinCluster '+source)
-    source_influences = cmds.skinCluster(source_cluster, q=1, inf=1)
-
-    threshold2 = threshold*threshold
-    for target in objs[1:]:
-        target_cluster = mel.eval('findRelatedSkinCluster '+target)
-        target_influences = cmds.skinCluster(target_cluster, q=1, inf=1)
-        new_influences = [influence for influence in source_influences if influence not in target_influences]
-        if new_influences:
-            cmds.skinCluster(target_cluster, e=1, addInfluence=new_influences, wt=0)
-            print "Added %d new influences to target %s" % (len(new_influences), target)
-        
-        count = 0
-        for vi in xrange(cmds.polyEvaluate(target, vertex=1)):
-            v = cmds.xform(target+".vtx[%d]"%vi, q=1, t=1, ws=0)
-            
-            (min_dist2, min_i) = min((((v[0]-sv[0])**2 + (v[1]-sv[1])**2 + (v[2]-sv[2])**2, i) for (i, sv) in enumerate(source_vertices)))
-
-            if min_dist2 < threshold2:
-                source_influences = zip(cmds.skinPercent(source_cluster, source+".vtx[%d]"%min_i, q=1, t=None), cmds.skinPercent(source_cluster, source+".vtx[%d]"%min_i, q=1, v=1))
-                cmds.skinPercent(target_cluster, target+".vtx[%d]"%vi, tv=source_influences, zeroRemainingInfluences=1)
-                count += 1
-            
-        print "Copied %d vertices to %s" % (count, target)
+    # Every weight and record write is its own undoable edit, grouped into one undo step
+    cmds.undoInfo(ock=1)
+    try:
+        source_cluster = mel.eval('findRelatedSkinCluster '+source)
+        source_shape = skin_shape(source_cluster)
+        source_influences = skin_influences(source_cluster)
+        source_points = get_points(source_shape)
+        source_checksums = weightChecksums(source_cluster, source_shape, chunkSize) if incremental and checkRepaint else None
+
+        for target in objs[1:]:
+            if cancelled:
+                break
+            (target_cluster, target_shape, target_influences, points, record, matches, vertices, columns,
+             new_record_points) = prepare_target(target, source_shape, source_influences, source_points, source_checksums,
+                                                 threshold, incremental, epsilon)
+            chunk = chunkSize or max(vertices.size, 1)
+
+            if progress:
+                cmds.progressBar(progress, e=1, bp=1, ii=1, max=max(vertices.size, 1), status="Copying skin weights to %s" % target)
+            copied = 0
+            done = 0
+            try:
+                for start in xrange(0, vertices.size, chunk):
+                    if progress and cmds.progressBar(progress, q=1, ic=1):
+                        cancelled = True
+                        break
+                    chunk_vertices = vertices[start:start+chunk]
+                    copied += transfer_chunk(source_cluster, source_shape, source_points, target_cluster, target_shape,
+                                             points, matches, chunk_vertices, columns, len(target_influences), threshold)
+                    new_record_points[chunk_vertices] = points[chunk_vertices]
+                    done += chunk_vertices.size
+                    if progress:
+                        cmds.progressBar(progress, e=1, s=chunk_vertices.size)
+            finally:
+                if progress:
+                    cmds.progressBar(progress, e=1, ep=1)
+                write_record(target_cluster, source_shape, threshold, new_record_points, source_points, source_checksums, matches)
+
+            if record:
+                print "Copied %d vertices to %s (%d of %d vertices changed)" % (copied, target, vertices.size, len(points))
+            else:
+                print "Copied %d vertices to %s" % (copied, target)
+            if cancelled:
+                print "Cancelled after %d of %d vertices, remaining vertices will be copied on the next run" % (done, vertices.size)
+            elif maxInfluences or pruneBelow or removeUnused:
+                post_process_cluster(target_cluster, maxInfluences, pruneBelow, removeUnused, chunkSize)
+    finally:
+        cmds.undoInfo(cck=1)
 
     cmds.select(objs)
+
+'''
+Same as CopySkinWeightsLimitedByDistance, but queued on the job scheduler (see
+jobScheduler) instead of blocking. Vertex matching for each chunk runs on a
+worker thread, weights are written between idle events. Returns the job.
+'''
+def copySkinWeightsJob(threshold = .01, incremental = True, epsilon = 1e-5, chunkSize = 5000, checkRepaint = False):
+    objs = cmds.ls(sl=1)
+    return queueJob("Copy skin weights", copy_skin_weights_steps(objs, threshold, incremental, epsilon, chunkSize, checkRepaint))
+
+'''
+Cleans up skin weights on each object (or selection).
+    maxInfluences=[int] - Keep only this many of the largest weights on each vertex. (default None)
+    pruneBelow=[float] - Zero out weights below this value. (default 0.0)
+    removeUnused=[bool] - Remove influences that end up with no weight from the skinCluster. (default False)
+    chunkSize=[int] - If provided, vertices are processed this many at a time. (default None)
+Weights are renormalized afterwards.
+'''
+def postProcessSkinWeights(*args, **kwargs):
+    objs = cmds.ls(sl=1) if not args else args
+    max_influences = kwargs.pop("maxInfluences", None)
+    prune_below = kwargs.pop("pruneBelow", 0.0)
+    remove_unused = kwargs.pop("removeUnused", False)
+    chunk_size = kwargs.pop("chunkSize", None)
+    if kwargs:
+        raise TypeError("Invalid flag %s" % kwargs.keys()[0])
+
+    cmds.undoInfo(ock=1)
+    try:
+        for obj in objs:
+            cluster = mel.eval('findRelatedSkinCluster '+obj)
+            if cluster:
+                post_process_cluster(cluster, max_influences, prune_below, remove_unused, chunk_size)
+            else:
+                print "Error: No skinCluster found on object", obj
+    finally:
+        cmds.undoInfo(cck=1)
+
+'''
+Limits a (vertices, influences) weight matrix to max_influences per vertex and
+prunes weights below prune_below, then renormalizes each vertex. A vertex that
+would be pruned to nothing keeps its largest influence. Returns a new matrix.
+'''
+def limitWeights(weights, max_influences=None, prune_below=0.0):
+    weights = np.array(weights, dtype=float)
+    rows = np.arange(len(weights))
+    largest = weights.argmax(axis=1) if weights.size else np.zeros(0, dtype=np.int64)
+    had_weight = weights.sum(axis=1) > 0
+
+    if max_influences and weights.shape[1] > max_influences:
+        drop = np.argsort(-weights, axis=1, kind="mergesort")[:, max_influences:]
+        weights[rows[:, None], drop] = 0.0
+    if prune_below:
+        weights[weights < prune_below] = 0.0
+
+    emptied = had_weight & (weights.sum(axis=1) <= 0)
+    weights[rows[emptied], largest[emptied]] = 1.0
+
+    totals = weights.sum(axis=1)[:, None]
+    return np.where(totals > 0, weights / np.where(totals > 0, totals, 1.0), weights)
+
+'''
+Finds the closest source point to each point, limited by distance. Points are
+bucketed in a grid with cells the size of the threshold, so only neighbouring
+cells are searched. Returns the matched source index for each point, or -1 if
+no source point is closer than threshold. Ties go to the lowest source index.
+'''
+def matchVertices(points, source_points, threshold):
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    source_points = np.asarray(source_points, dtype=float).reshape(-1, 3)
+    matches = np.full(len(points), -1, dtype=np.int64)
+    if not len(points) or not len(source_points):
+        return matches
+
+    origin = np.minimum(points.min(axis=0), source_points.min(axis=0))
+    cells = np.floor((points - origin) / threshold).astype(np.int64) + 1
+    source_cells = np.floor((source_points - origin) / threshold).astype(np.int64) + 1
+    dims = np.maximum(cells.max(axis=0), source_cells.max(axis=0)) + 2
+
+    def cell_keys(c):
+        return (c[:, 0] * dims[1] + c[:, 1]) * dims[2] + c[:, 2]
+
+    order = np.argsort(cell_keys(source_cells), kind="mergesort")
+    sorted_keys = cell_keys(source_cells)[order]
+
+    # Gather candidate pairs from the 27 neighbouring cells
+    pairs = []
+    for offset in itertools.product((-1, 0, 1), repeat=3):
+        keys = cell_keys(cells + np.array(offset))
+        lo = np.searchsorted(sorted_keys, keys, "left")
+        counts = np.searchsorted(sorted_keys, keys, "right") - lo
+        total = counts.sum()
+        if total:
+            starts = np.repeat(np.cumsum(counts) - counts, counts)
+            pairs.append((np.repeat(np.arange(len(points)), counts),
+                          order[np.repeat(lo, counts) + np.arange(total) - starts]))
+    if not pairs:
+        return matches
+
+    point_idx = np.concatenate([p for (p, _) in pairs])
+    source_idx = np.concatenate([s for (_, s) in pairs])
+    dist2 = ((points[point_idx] - source_points[source_idx])**2).sum(axis=1)
+
+    close = dist2 < threshold * threshold
+    (point_idx, source_idx, dist2) = (point_idx[close], source_idx[close], dist2[close])
+    best = np.lexsort((source_idx, dist2, point_idx))
+    first = np.ones(best.size, dtype=bool)
+    first[1:] = point_idx[best][1:] != point_idx[best][:-1]
+    matches[point_idx[best[first]]] = source_idx[best[first]]
+    return matches
+
+'''
+Finds the target vertices that need to be re-transferred since the recorded
+transfer: vertices that moved, vertices matched to a source vertex that moved
+or was repainted, and vertices that are now within threshold of a moved source
+vertex. Source weights are compared through their checksums (see
+weightChecksums), if provided.
+'''
+def dirtyVertices(points, record_points, source_points, record_source_points, matches, threshold, epsilon,
+                  source_checksums=None, record_source_checksums=None):
+    epsilon2 = epsilon * epsilon
+    dirty = ((points - record_points)**2).sum(axis=1) > epsilon2
+
+    moved_source = np.flatnonzero(((source_points - record_source_points)**2).sum(axis=1) > epsilon2)
+    if moved_source.size:
+        dirty |= np.in1d(matches, moved_source)
+        dirty |= matchVertices(points, source_points[moved_source], threshold) >= 0
+
+    if source_checksums is not None and record_source_checksums is not None:
+        repainted = np.flatnonzero(~np.isclose(source_checksums, record_source_checksums, rtol=0, atol=1e-9))
+        if repainted.size:
+            dirty |= np.in1d(matches, repainted)
+    return dirty
+
+'''
+One checksum per vertex of a skinCluster's weights. Each influence is given a
+fixed coefficient from its name, so checksums don't depend on influence order.
+Read chunkSize vertices at a time, if provided.
+'''
+def weightChecksums(cluster, shape, chunkSize=None):
+    influences = skin_influences(cluster)
+    coefficients = np.array([1.0 + (zlib.crc32(influence.split("|")[-1]) & 0xffffffff) / 2.0**32 for influence in influences])
+    vertex_count = om.MFnMesh(get_dag_path(shape)).numVertices
+    chunk = chunkSize or max(vertex_count, 1)
+
+    checksums = np.zeros(vertex_count)
+    for start in xrange(0, vertex_count, chunk):
+        vertices = np.arange(start, min(start + chunk, vertex_count))
+        checksums[vertices] = get_weights(cluster, shape, vertices).dot(coefficients)
+    return checksums
+
+##
+## INTERNAL
+##
+
+'''
+Adds missing influences to a target, and works out which of its vertices need
+a transfer. Repaints are only caught if source_checksums are provided.
+'''
+def prepare_target(target, source_shape, source_influences, source_points, source_checksums, threshold, incremental, epsilon):
+    target_cluster = mel.eval('findRelatedSkinCluster '+target)
+    target_influences = skin_influences(target_cluster)
+    new_influences = [influence for influence in source_influences if influence not in target_influences]
+    if new_influences:
+        cmds.skinCluster(target_cluster, e=1, addInfluence=new_influences, wt=0)
+        target_influences = skin_influences(target_cluster)
+        print "Added %d new influences to target %s" % (len(new_influences), target)
+
+    target_shape = skin_shape(target_cluster)
+    points = get_points(target_shape)
+
+    record = read_record(target_cluster, source_shape, threshold, len(points), len(source_points),
+                         source_checksums is not None) if incremental else None
+    if record:
+        (record_points, record_source_points, record_source_checksums, matches) = record
+        dirty = dirtyVertices(points, record_points, source_points, record_source_points, matches, threshold, epsilon,
+                              source_checksums, record_source_checksums)
+    else:
+        matches = np.full(len(points), -1, dtype=np.int64)
+        dirty = np.ones(len(points), dtype=bool)
+
+    vertices = np.flatnonzero(dirty)
+    columns = [target_influences.index(influence) for influence in source_influences]
+
+    # Vertices not yet transferred are recorded at infinity, so they're dirty
+    # next time if this run is cancelled
+    new_record_points = record[0] if record else np.full(points.shape, np.inf)
+    new_record_points[vertices] = np.inf
+    return (target_cluster, target_shape, target_influences, points, record, matches, vertices, columns, new_record_points)
+
+''' Job steps for copySkinWeightsJob, one chunk of vertices per step '''
+def copy_skin_weights_steps(objs, threshold, incremental, epsilon, chunkSize, checkRepaint):
+    source = objs[0]
+    source_cluster = mel.eval('findRelatedSkinCluster '+source)
+    source_shape = skin_shape(source_cluster)
+    source_influences = skin_influences(source_cluster)
+    source_points = get_points(source_shape)
+    source_checksums = weightChecksums(source_cluster, source_shape, chunkSize) if incremental and checkRepaint else None
+
+    for (t, target) in enumerate(objs[1:]):
+        (target_cluster, target_shape, target_influences, points, record, matches, vertices, columns,
+         new_record_points) = prepare_target(target, source_shape, source_influences, source_points, source_checksums,
+                                             threshold, incremental, epsilon)
+
+        copied = 0
+        try:
+            for start in xrange(0, vertices.size, chunkSize):
+                chunk_vertices = vertices[start:start+chunkSize]
+                matches[chunk_vertices] = yield background(matchVertices, points[chunk_vertices], source_points, threshold)
+                copied += write_chunk(source_cluster, source_shape, target_cluster, target_shape,
+                                      matches, chunk_vertices, columns, len(target_influences))
+                new_record_points[chunk_vertices] = points[chunk_vertices]
+                yield (t + float(start + chunk_vertices.size) / vertices.size) / (len(objs) - 1)
+        finally:
+            write_record(target_cluster, source_shape, threshold, new_record_points, source_points, source_checksums, matches)
+        print "Copied %d vertices to %s (%d of %d vertices changed)" % (copied, target, vertices.size, len(points))
+
+'''
+Matches and writes weights for one chunk of target vertices (sorted indices),
+updating matches in place. Only this chunk's weights are held in memory.
+Returns the number of vertices copied.
+'''
+def transfer_chunk(source_cluster, source_shape, source_points, target_cluster, target_shape,
+                   points, matches, vertices, columns, influence_count, threshold):
+    matches[vertices] = matchVertices(points[vertices], source_points, threshold)
+    return write_chunk(source_cluster, source_shape, target_cluster, target_shape, matches, vertices, columns, influence_count)
+
+''' Writes weights to already matched vertices, returns how many were copied '''
+def write_chunk(source_cluster, source_shape, target_cluster, target_shape, matches, vertices, columns, influence_count):
+    copied = vertices[matches[vertices] >= 0]
+
+    if copied.size:
+        (source_vertices, inverse) = np.unique(matches[copied], return_inverse=True)
+        weights = np.zeros((copied.size, influence_count))
+        weights[:, columns] = get_weights(source_cluster, source_shape, source_vertices)[inverse]
+        set_weights(target_cluster, target_shape, copied, weights)
+    return copied.size
+
+def get_dag_path(node):
+    sel = om.MSelectionList()
+    sel.add(node)
+    return sel.getDagPath(0)
+
+def get_skin_fn(cluster):
+    sel = om.MSelectionList()
+    sel.add(cluster)
+    return oma.MFnSkinCluster(sel.getDependNode(0))
+
+''' Deformed (output) shape of a skinCluster '''
+def skin_shape(cluster):
+    return cmds.ls(cmds.skinCluster(cluster, q=1, g=1)[0], l=1)[0]
+
+''' Influence names, in skinCluster (weight) order '''
+def skin_influences(cluster):
+    return [dag.fullPathName() for dag in get_skin_fn(cluster).influenceObjects()]
+
+''' Object space vertex positions as a (vertices, 3) array '''
+def get_points(shape):
+    points = om.MFnMesh(get_dag_path(shape)).getPoints(om.MSpace.kObject)
+    return np.array([(p.x, p.y, p.z) for p in points], dtype=float).reshape(-1, 3)
+
+def vertex_component(vertices):
+    fn = om.MFnSingleIndexedComponent()
+    comp = fn.create(om.MFn.kMeshVertComponent)
+    fn.addElements([int(v) for v in vertices])
+    return comp
+
+''' Weights of sorted, unique vertices as a (vertices, influences) array '''
+def get_weights(cluster, shape, vertices):
+    (weights, influence_count) = get_skin_fn(cluster).getWeights(get_dag_path(shape), vertex_component(vertices))
+    return np.array(weights, dtype=float).reshape(-1, influence_count)
+
+''' Sets weights of sorted, unique vertices from a (vertices, influences) array, as an undoable edit '''
+def set_weights(cluster, shape, vertices, weights):
+    fn = get_skin_fn(cluster)
+    dag = get_dag_path(shape)
+    comp = vertex_component(vertices)
+    influences = om.MIntArray(range(weights.shape[1]))
+    new_weights = om.MDoubleArray(weights.ravel().tolist())
+
+    def edit():
+        old_weights = fn.setWeights(dag, comp, influences, new_weights, normalize=False, returnOldWeights=True)
+        return lambda: fn.setWeights(dag, comp, influences, old_weights, normalize=False)
+
+    undoableEdit(edit)
+
+''' Post-processes every vertex of a skinCluster, writing each chunk (or the whole matrix) in one call '''
+def post_process_cluster(cluster, max_influences, prune_below, remove_unused, chunk_size=None):
+    shape = skin_shape(cluster)
+    influences = skin_influences(cluster)
+    vertex_count = om.MFnMesh(get_dag_path(shape)).numVertices
+    chunk = chunk_size or max(vertex_count, 1)
+
+    used = np.zeros(len(influences), dtype=bool)
+    (before, after) = (0, 0)
+    for start in xrange(0, vertex_count, chunk):
+        vertices = np.arange(start, min(start + chunk, vertex_count))
+        weights = get_weights(cluster, shape, vertices)
+        limited = limitWeights(weights, max_influences, prune_below)
+        set_weights(cluster, shape, vertices, limited)
+        used |= (limited > 0).any(axis=0)
+        before += int((weights > 0).sum())
+        after += int((limited > 0).sum())
+
+    unused = [influence for (influence, u) in zip(influences, used) if not u]
+    if remove_unused and unused and len(unused) < len(influences):
+        cmds.skinCluster(cluster, e=1, removeInfluence=unused)
+    print "Post-processed %s: %d to %d non-zero weights, %d unused influences%s" % (
+        cluster, before, after, len(unused), " removed" if remove_unused else "")
+
+# Transfer record, stored on the target skinCluster
+
+def record_plug(cluster, attr):
+    sel = om.MSelectionList()
+    sel.add(cluster)
+    return om.MFnDependencyNode(sel.getDependNode(0)).findPlug(attr, False)
+
+'''
+Returns (points, source points, source weight checksums, matches) of the last
+transfer, or None if missing or made with different settings. Checksums are
+only read with check_repaint (None otherwise), and a record without them is
+then unusable.
+'''
+def read_record(cluster, source_shape, threshold, point_count, source_point_count, check_repaint=False):
+    if not cmds.attributeQuery("copySkinSourceWeights", node=cluster, ex=1):
+        return None
+    if record_plug(cluster, "copySkinSource").asString() != source_shape or record_plug(cluster, "copySkinThreshold").asDouble() != threshold:
+        return None
+
+    points = np.array(om.MFnDoubleArrayData(record_plug(cluster, "copySkinPoints").asMObject()).array(), dtype=float).reshape(-1, 3)
+    source_points = np.array(om.MFnDoubleArrayData(record_plug(cluster, "copySkinSourcePoints").asMObject()).array(), dtype=float).reshape(-1, 3)
+    matches = np.array(om.MFnIntArrayData(record_plug(cluster, "copySkinMatches").asMObject()).array(), dtype=np.int64)
+    if len(points) != point_count or len(matches) != point_count or len(source_points) != source_point_count:
+        return None
+    source_checksums = None
+    if check_repaint:
+        source_checksums = np.array(om.MFnDoubleArrayData(record_plug(cluster, "copySkinSourceWeights").asMObject()).array(), dtype=float)
+        if len(source_checksums) != source_point_count:
+            return None
+    return (points, source_points, source_checksums, matches)
+
+'''
+Writes the transfer record, as an undoable edit. Without source_checksums, the
+recorded checksums are cleared, as they may no longer match the source.
+'''
+def write_record(cluster, source_shape, threshold, points, source_points, source_checksums, matches):
+    for (attr, kwargs) in (("copySkinSource", {"dt": "string"}), ("copySkinThreshold", {"at": "double"}),
+                           ("copySkinPoints", {"dt": "doubleArray"}), ("copySkinSourcePoints", {"dt": "doubleArray"}),
+                           ("copySkinSourceWeights", {"dt": "doubleArray"}), ("copySkinMatches", {"dt": "Int32Array"})):
+        if not cmds.attributeQuery(attr, node=cluster, ex=1):
+            cmds.addAttr(cluster, ln=attr, h=1, **kwargs)
+
+    values = [("copySkinPoints", om.MFnDoubleArrayData().create(om.MDoubleArray(points.ravel().tolist()))),
+              ("copySkinSourcePoints", om.MFnDoubleArrayData().create(om.MDoubleArray(source_points.ravel().tolist()))),
+              ("copySkinSourceWeights", om.MFnDoubleArrayData().create(om.MDoubleArray(source_checksums.tolist() if source_checksums is not None else []))),
+              ("copySkinMatches", om.MFnIntArrayData().create(om.MIntArray(matches.tolist())))]
+
+    def edit():
+        modifier = om.MDGModifier()
+        modifier.newPlugValueString(record_plug(cluster, "copySkinSource"), source_shape)
+        modifier.newPlugValueDouble(record_plug(cluster, "copySkinThreshold"), threshold)
+        for (attr, data) in values:
+            modifier.newPlugValue(record_plug(cluster, attr), data)
+        modifier.doIt()
+        return modifier.undoIt
+
+    undoableEdit(edit)
@@ -0,0 +1,118 @@
+# Copyright 2022 by Kyle Joswiak
+#
+# This is released under the "MIT License Agreement".
+# See License file that should have been included in distribution.
+'''
+Flips selected uv coordinates horizontally. By default every uv shell in the
+selection is flipped across the midpoint of its own bound (extremities), so
+several selected shells each stay in place. UVs and face connectivity are read
+in bulk through the API, and shells are found with a vectorized union-find.
+'''
+
+import numpy as np
+import maya.cmds as cmds
+import maya.api.OpenMaya as om
+
+'''
+Flip selected uvs horizontally.
+    perShell=[bool] - Flip each uv shell across its own center. If False, the
+        whole selection is flipped across the center of its combined bound. (default True)
+'''
+def UVFlipHorizontal(perShell=True):
+    uvs = cmds.polyListComponentConversion(cmds.ls(sl=1), tuv=1)
+    if not uvs:
+        return
+
+    if not perShell:
+        uv = np.array(cmds.polyEditUV(uvs, q=1)).reshape(-1, 2)
+        (lo, hi) = (uv.min(axis=0), uv.max(axis=0))
+        cmds.polyEditUV(uvs, pu=(lo[0] + hi[0]) / 2.0, pv=(lo[1] + hi[1]) / 2.0, su=-1, sv=1)
+        return
+
+    sel = om.MSelectionList()
+    for uv in uvs:
+        sel.add(uv)
+
+    edits = []
+    for i in xrange(sel.length()):
+        (dag, comp) = sel.getComponent(i)
+        fn = om.MFnMesh(dag)
+        uv_set = fn.currentUVSetName()
+
+        (us, vs) = fn.getUVs(uv_set)
+        (face_counts, face_uv_ids) = fn.getAssignedUVs(uv_set)
+        selected = np.array(om.MFnSingleIndexedComponent(comp).getElements(), dtype=np.int64)
+        if not selected.size:
+            continue
+
+        labels = findUVShells(len(us), face_counts, face_uv_ids)
+        (shell_ids, u_min, u_max) = uvShellBounds(np.asarray(us)[selected], labels[selected])
+        (_, v_min, v_max) = uvShellBounds(np.asarray(vs)[selected], labels[selected])
+
+        shell_of = np.searchsorted(shell_ids, labels[selected])
+        for s in xrange(len(shell_ids)):
+            ranges = index_ranges(selected[shell_of == s])
+            components = ["%s.map[%d:%d]" % (dag.fullPathName(), a, b) for (a, b) in ranges]
+            edits.append((components, (u_min[s] + u_max[s]) / 2.0, (v_min[s] + v_max[s]) / 2.0))
+
+    cmds.undoInfo(ock=1)
+    try:
+        for (components, pu, pv) in edits:
+            cmds.polyEditUV(components, pu=pu, pv=pv, su=-1, sv=1)
+    finally:
+        cmds.undoInfo(cck=1)
+
+'''
+Finds uv shells. Takes the number of uvs, and the per face uv counts and
+flattened per face uv ids (as returned by MFnMesh.getAssignedUVs). Returns an
+array with a shell index (0 to number of shells - 1) for every uv. Uvs not
+assigned to any face are their own shell.
+'''
+def findUVShells(uv_count, face_counts, face_uv_ids):
+    face_counts = np.asarray(face_counts, dtype=np.int64)
+    face_uv_ids = np.asarray(face_uv_ids, dtype=np.int64)
+    labels = np.arange(uv_count, dtype=np.int64)
+
+    # Link every face uv to the first uv of its face
+    a = face_uv_ids
+    b = face_uv_ids[np.repeat(np.cumsum(face_counts) - face_counts, face_counts)]
+
+    while a.size:
+        (la, lb) = (labels[a], labels[b])
+        if np.array_equal(la, lb):
+            break
+        # Hook roots onto the smaller root, then flatten with pointer jumping
+        m = np.minimum(la, lb)
+        np.minimum.at(labels, la, m)
+        np.minimum.at(labels, lb, m)
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+
+    return np.unique(labels, return_inverse=True)[1]
+
+'''
+Per shell minimum and maximum of a set of values. Returns (shell ids, minimums,
+maximums) with one entry per shell present in labels.
+'''
+def uvShellBounds(values, labels):
+    (shell_ids, inverse) = np.unique(labels, return_inverse=True)
+    lo = np.full(len(shell_ids), np.inf)
+    hi = np.full(len(shell_ids), -np.inf)
+    np.minimum.at(lo, inverse, values)
+    np.maximum.at(hi, inverse, values)
+    return (shell_ids, lo, hi)
+
+##
+## INTERNAL
+##
+
+''' Compresses sorted indices into inclusive (start, end) ranges '''
+def index_ranges(indices):
+    indices = np.sort(indices)
+    breaks = np.flatnonzero(np.diff(indices) != 1)
+    starts = np.concatenate(([0], breaks + 1))
+    ends = np.concatenate((breaks, [len(indices) - 1]))
+    return zip(indices[starts].tolist(), indices[ends].tolist())
@@ -0,0 +1,87 @@
+# Copyright 2022 by Kyle Joswiak
+#
+# This is released under the "MIT License Agreement".
+# See License file that should have been included in distribution.
+'''
+Makes API edits undoable. Edits made through the API from a script (ie
+MFnSkinCluster.setWeights, MFnAnimCurve.addKeys) aren't recorded in the undo
+queue, only commands are. undoableEdit runs an edit through a small command
+(apiUndoCommand.py, loaded as a plugin on first use), so it undoes and redoes
+like any other command, and joins any open undo chunk.
+
+Work spread over time (ie jobScheduler steps) can also be captured as units
+with runAsUnit, without touching the undo queue, and registered once at the
+end as a single command with undoableUnits.
+'''
+
+import os
+import sys
+import maya.cmds as cmds
+import maya.api.OpenMaya as om
+
+'''
+Runs edit as an undoable command. edit makes the change, and returns a
+function that reverts it. Redo calls edit again, so it has to work from
+values captured up front rather than from the scene.
+'''
+def undoableEdit(edit):
+    load_command_plugin()
+    pending_edits.append(edit)
+    try:
+        cmds.apiUndoEdit()
+    finally:
+        # Only left over if the command failed before taking it
+        if edit in pending_edits:
+            pending_edits.remove(edit)
+
+'''
+Runs fn() inside an MDGModifier, so the (undoable) commands it makes are
+captured as one reversible unit instead of going on the undo queue. Returns
+(unit, result, exc_info), exc_info being sys.exc_info() if fn raised (the
+unit then holds whatever fn did before raising), or None. The unit is already
+applied: revert it with unit.undoIt(), or pass it to undoableUnits.
+'''
+def runAsUnit(fn):
+    outcome = []
+    def run():
+        # Only the first run executes fn, a redo of the modifier must not run it again
+        if outcome:
+            return
+        try:
+            outcome.append((fn(), None))
+        except Exception:
+            outcome.append((None, sys.exc_info()))
+
+    unit = om.MDGModifier()
+    unit.pythonCommandToExecute(run)
+    unit.doIt()
+    (result, exc_info) = outcome[0]
+    return (unit, result, exc_info)
+
+''' Registers already applied units (see runAsUnit) as a single undoable command '''
+def undoableUnits(units):
+    if not units:
+        return
+    applied = [True]
+    def edit():
+        if not applied[0]:
+            for unit in units:
+                unit.doIt()
+            applied[0] = True
+        def revert():
+            for unit in reversed(units):
+                unit.undoIt()
+            applied[0] = False
+        return revert
+    undoableEdit(edit)
+
+##
+## INTERNAL
+##
+
+# Edits waiting for apiUndoEdit to pick them up
+pending_edits = []
+
+def load_command_plugin():
+    if not cmds.pluginInfo("apiUndoCommand", q=1, loaded=1):
+        cmds.loadPlugin(os.path.join(os.path.dirname(os.path.abspath(__file__)), "apiUndoCommand.py"), quiet=1)
@@ -0,0 +1,48 @@
+# Copyright 2022 by Kyle Joswiak
+#
+# This is released under the "MIT License Agreement".
+# See License file that should have been included in distribution.
+'''
+Plugin for apiUndo. Registers the apiUndoEdit command, which takes the next
+pending edit from apiUndo and keeps it for undo and redo. Not meant to be
+called directly, see apiUndo.undoableEdit.
+'''
+
+import maya.api.OpenMaya as om
+
+def maya_useNewAPI():
+    pass
+
+class ApiUndoEdit(om.MPxCommand):
+    name = "apiUndoEdit"
+
+    def __init__(self):
+        om.MPxCommand.__init__(self)
+        self.edit = None
+        self.revert = None
+
+    @staticmethod
+    def creator():
+        return ApiUndoEdit()
+
+    def doIt(self, args):
+        import apiUndo
+        if not apiUndo.pending_edits:
+            raise RuntimeError("apiUndoEdit has no pending edit, use apiUndo.undoableEdit")
+        self.edit = apiUndo.pending_edits.pop()
+        self.redoIt()
+
+    def redoIt(self):
+        self.revert = self.edit()
+
+    def undoIt(self):
+        self.revert()
+
+    def isUndoable(self):
+        return True
+
+def initializePlugin(plugin):
+    om.MFnPlugin(plugin, "Kyle Joswiak", "1.0").registerCommand(ApiUndoEdit.name, ApiUndoEdit.creator)
+
+def uninitializePlugin(plugin):
+    om.MFnPlugin(plugin).deregisterCommand(ApiUndoEdit.name)
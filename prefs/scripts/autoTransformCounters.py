@@ -3,7 +3,11 @@
 # This is released under the "MIT License Agreement".
 # See License file that should have been included in distribution.
 
+import ast
 import maya.cmds as cmds
+import maya.api.OpenMaya as om
+
+from jobScheduler import queueJob
 
 ''' Counters roation, but not translation. See CounterTransform for additional arguments. '''
 def counterRotate(*args, **kwargs):
@@ -29,6 +33,8 @@ Arguments:
     addBlends=[bool] - Whether or not to add blend nodes. Doing so allows scaling or altering the degree of countering. (default True)
     hideUtilityNodes=[bool] - Whether or not to hide utility nodes from the attribute editor.
         Done by setting .isHistoricallyInteresting to false. (defualt True)
+
+Rigs are tagged (on the pivot group) so they can be found by counterIndex.
 '''
 def counterTransform(*args, **kwargs):
     objs = cmds.ls(sl=1) if not args else args
@@ -49,7 +55,11 @@ def counterTransform(*args, **kwargs):
     if not (rotation or translation):
         raise ValueError("Need to specify at least one of rotation or translation")
 
+    options = {"rotation": rotation, "translation": translation, "addBlends": addBlends, "addOffsets": addOffsets,
+               "maintainOffsets": maintainOffsets, "hideUtilityNodes": hideUtilityNodes}
+
     new_objs = [] # New paths of input objects
+    new_pivots = []
     for obj in objs:
         prnt = cmds.listRelatives(obj, p=1, f=1)
 
@@ -194,15 +204,419 @@ def counterTransform(*args, **kwargs):
             for node in utilityNodes:
                 cmds.setAttr(node + ".isHistoricallyInteresting", 0)
 
+        # Zeroed values are kept on the tag, so removing the rig can restore them
+        zeroed = {}
         for attr in (["tx","ty","tz"] if translation else []) + (["rx","ry","rz"] if rotation else []):
             if cmds.getAttr(obj + "." + attr, se=1):
+                zeroed[attr] = cmds.getAttr(obj + "." + attr)
                 cmds.setAttr(obj + "." + attr, 0)
         obj = cmds.parent(obj, pvt_grp, r=1)[0]
         pvt_grp = cmds.rename(pvt_grp, "grp_counter_" + obj.split("|")[-1])
         if offset_grp:
             offset_grp = cmds.rename(offset_grp, "grp_counter_offset_" + obj.split("|")[-1])
+        tag_counter_rig(pvt_grp, obj, ctrl_nd, offset_grp, utilityNodes, options, zeroed)
 
         new_objs.append(obj)
+        new_pivots.append(cmds.ls(pvt_grp, l=1)[0])
+
+    # New rigs are added to the index directly, their groups aren't tagged yet when the node added callback runs
+    if not counter_index_state["dirty"]:
+        index_rigs(read_tagged_rigs(new_pivots))
 
     cmds.select(new_objs)
     return new_objs
+
+'''
+Returns the index of all counter rigs in the scene, as a dictionary of pivot
+group -> rig. Each rig is a dictionary with "object", "pivot", "offset",
+"network", "utilities" (node paths, None if missing), "options" (the
+counterTransform arguments used to build it) and "values" (the channel values
+it zeroed, None for older rigs). The index is built with a few
+bulk queries the first time it's used, and then kept up to date by node
+added/removed callbacks, which only look at pivot groups.
+'''
+def counterIndex():
+    update_counter_index()
+    return dict((resolve_node(uuid), resolve_rig(rig)) for (uuid, rig) in counter_index.items())
+
+'''
+Removes the counter rigs of each object (or selection), restoring their original
+parenting and values: objects are parented back relatively, and the values
+counterTransform zeroed are added back onto their channels (keyed or driven
+channels are left alone, as they were then). Offsets on the rig's network
+stand in for those values, as they may have been edited since. Accepts
+countered objects or any node belonging to a rig. Returns the restored objects.
+'''
+def removeCounters(*args):
+    rigs = find_counter_rigs(cmds.ls(sl=1, l=1) if not args else cmds.ls(args, l=1))
+
+    restored = []
+    cmds.undoInfo(ock=1)
+    try:
+        for rig in rigs:
+            restored.append(remove_counter_rig(rig))
+    finally:
+        cmds.undoInfo(cck=1)
+
+    restored = [obj for obj in restored if obj]
+    print "Removed %d counter rigs" % len(rigs)
+    if restored:
+        cmds.select(restored)
+    return restored
+
+'''
+Rebuilds the counter rigs of each object (or selection) with the options they
+were built with, overridden by any counterTransform arguments provided.
+Returns the new paths of the countered objects.
+'''
+def rebuildCounters(*args, **kwargs):
+    rigs = find_counter_rigs(cmds.ls(sl=1, l=1) if not args else cmds.ls(args, l=1))
+
+    new_objs = []
+    cmds.undoInfo(ock=1)
+    try:
+        for rig in rigs:
+            options = rebuild_options(rig, kwargs)
+            obj = remove_counter_rig(rig)
+            if obj:
+                new_objs.extend(counterTransform(obj, **options))
+    finally:
+        cmds.undoInfo(cck=1)
+
+    print "Rebuilt %d counter rigs" % len(new_objs)
+    if new_objs:
+        cmds.select(new_objs)
+    return new_objs
+
+'''
+Job versions of counterTransform, removeCounters and rebuildCounters. Instead of
+blocking, they're queued on the job scheduler (see jobScheduler) and handle one
+object per step. Take the same arguments, and return the job.
+'''
+def counterTransformJob(*args, **kwargs):
+    objs = cmds.ls(sl=1, uuid=1) if not args else cmds.ls(args, uuid=1)
+    return queueJob("Counter transforms", counter_steps(objs, lambda obj: counterTransform(obj, **kwargs)))
+
+def removeCountersJob(*args):
+    rigs = find_counter_rigs(cmds.ls(sl=1, l=1) if not args else cmds.ls(args, l=1), resolve=False)
+    return queueJob("Remove counters", counter_steps(rigs, remove_counter_rig))
+
+def rebuildCountersJob(*args, **kwargs):
+    rigs = find_counter_rigs(cmds.ls(sl=1, l=1) if not args else cmds.ls(args, l=1), resolve=False)
+
+    def rebuild(rig):
+        options = rebuild_options(rig, kwargs)
+        obj = remove_counter_rig(rig)
+        return counterTransform(obj, **options) if obj else []
+
+    return queueJob("Rebuild counters", counter_steps(rigs, rebuild))
+
+'''
+Lists counter rigs whose network has been broken: rigs whose countered object,
+network or utility nodes are missing, whose object is no longer parented under
+its pivot group, or whose pivot group is no longer driven. Returns a dictionary
+of pivot group -> list of problems.
+'''
+def brokenCounters():
+    broken = {}
+    for (pivot, rig) in counterIndex().items():
+        problems = []
+        if not rig["object"]:
+            problems.append("countered object missing")
+        elif (cmds.listRelatives(rig["object"], p=1, f=1) or [None])[0] != pivot:
+            problems.append("object not parented under pivot group")
+        if rig["options"]["addBlends"] or rig["options"]["addOffsets"]:
+            if not rig["network"]:
+                problems.append("network node missing")
+            elif not cmds.listConnections(rig["network"] + ".historyConnection", s=1, d=0):
+                problems.append("network disconnected from object")
+        if None in rig["utilities"] or not rig["utilities"]:
+            problems.append("utility nodes missing")
+        if not cmds.listConnections(pivot + ".translate", s=1, d=0):
+            problems.append("pivot group translation not driven")
+        if rig["options"]["rotation"] and not cmds.listConnections(pivot + ".rotate", s=1, d=0):
+            problems.append("pivot group rotation not driven")
+        if problems:
+            broken[pivot] = problems
+    return broken
+
+##
+## INTERNAL
+##
+
+# Counter rig index, pivot group uuid -> rig (node uuids and options)
+counter_index = {}
+# Reverse index, uuid of every node of every indexed rig -> pivot group uuid
+counter_members = {}
+# Pivot groups added to the scene (ie by undo or duplicate) since the index was last updated
+counter_index_state = {"dirty": True, "callbacks": [], "added": set()}
+
+counter_tags = ("counterObject", "counterNetwork", "counterOffsetGroup", "counterUtilityNodes")
+
+'''
+Job steps for the counter jobs, calls fn on each item (object uuid or rig).
+Items are resolved to paths just before their step, as earlier steps may have
+reparented them.
+'''
+def counter_steps(items, fn):
+    for (i, item) in enumerate(items):
+        item = resolve_rig(item) if isinstance(item, dict) else resolve_node(item)
+        if item:
+            fn(item)
+        yield float(i + 1) / len(items)
+
+'''
+Tags a new rig's pivot group with message connections to the rest of the rig,
+its options and the object's channel values it zeroed
+'''
+def tag_counter_rig(pvt_grp, obj, ctrl_nd, offset_grp, utilityNodes, options, zeroed):
+    cmds.addAttr(pvt_grp, ln="counterObject", at="message", h=1)
+    cmds.addAttr(pvt_grp, ln="counterNetwork", at="message", h=1)
+    cmds.addAttr(pvt_grp, ln="counterOffsetGroup", at="message", h=1)
+    cmds.addAttr(pvt_grp, ln="counterUtilityNodes", at="message", m=1, im=0, h=1)
+    cmds.addAttr(pvt_grp, ln="counterOptions", dt="string", h=1)
+    cmds.addAttr(pvt_grp, ln="counterValues", dt="string", h=1)
+
+    cmds.connectAttr(obj + ".msg", pvt_grp + ".counterObject")
+    if ctrl_nd:
+        cmds.connectAttr(ctrl_nd + ".msg", pvt_grp + ".counterNetwork")
+    if offset_grp:
+        cmds.connectAttr(offset_grp + ".msg", pvt_grp + ".counterOffsetGroup")
+    for node in utilityNodes:
+        cmds.connectAttr(node + ".msg", pvt_grp + ".counterUtilityNodes", na=1)
+    cmds.setAttr(pvt_grp + ".counterOptions", repr(options), type="string")
+    cmds.setAttr(pvt_grp + ".counterValues", repr(zeroed), type="string")
+
+def build_counter_index():
+    install_counter_callbacks()
+    counter_index.clear()
+    counter_members.clear()
+    counter_index_state["added"] = set()
+
+    tagged = cmds.ls("*.counterObject", r=1, o=1, l=1) or []
+    index_rigs(read_tagged_rigs(tagged))
+
+    # Rigs made before rigs were tagged are found by name
+    tagged = set(tagged)
+    index_untagged_rigs([pivot for pivot in cmds.ls("grp_counter_*", r=1, type="transform", l=1) or [] if pivot not in tagged])
+
+    counter_index_state["dirty"] = False
+
+''' Brings the index up to date: a full build if dirty, otherwise only pivot groups added since the last update are read '''
+def update_counter_index():
+    if counter_index_state["dirty"]:
+        build_counter_index()
+        return
+
+    added = counter_index_state["added"]
+    if not added:
+        return
+    counter_index_state["added"] = set()
+    pivots = [pivot for pivot in (resolve_node(uuid) for uuid in added) if pivot]
+    tagged = [pivot for pivot in pivots if cmds.attributeQuery("counterObject", node=pivot, ex=1)]
+    index_rigs(read_tagged_rigs(tagged))
+    index_untagged_rigs([pivot for pivot in pivots if pivot not in tagged])
+
+def index_untagged_rigs(pivots):
+    for pivot in pivots:
+        if not pivot.split("|")[-1].split(":")[-1].startswith("grp_counter_offset_"):
+            rig = infer_rig(pivot)
+            if rig:
+                index_rigs({rig["pivot"]: rig})
+
+''' Adds rigs (pivot group uuid -> rig) to the index, replacing any already indexed '''
+def index_rigs(rigs):
+    for (pivot_uuid, rig) in rigs.items():
+        unindex_rig(pivot_uuid)
+        counter_index[pivot_uuid] = rig
+        for uuid in [rig["pivot"], rig["object"], rig["network"], rig["offset"]] + rig["utilities"]:
+            if uuid:
+                counter_members[uuid] = pivot_uuid
+
+def unindex_rig(pivot_uuid):
+    rig = counter_index.pop(pivot_uuid, None)
+    if rig:
+        for uuid in [rig["pivot"], rig["object"], rig["network"], rig["offset"]] + rig["utilities"]:
+            if counter_members.get(uuid) == pivot_uuid:
+                del counter_members[uuid]
+
+''' Reads tagged rigs, with one connection query per tag for all pivot groups at once '''
+def read_tagged_rigs(pivots):
+    rigs = {}
+    if not pivots:
+        return rigs
+
+    uuids = dict((pivot, cmds.ls(pivot, uuid=1)[0]) for pivot in pivots)
+    for pivot in pivots:
+        options = ast.literal_eval(cmds.getAttr(pivot + ".counterOptions") or "{}") or default_counter_options()
+        # Rigs tagged before values were kept have none
+        values = None
+        if cmds.attributeQuery("counterValues", node=pivot, ex=1):
+            values = ast.literal_eval(cmds.getAttr(pivot + ".counterValues") or "{}")
+        rigs[uuids[pivot]] = {"pivot": uuids[pivot], "object": None, "network": None, "offset": None,
+                              "utilities": [], "options": options, "values": values}
+
+    keys = {"counterObject": "object", "counterNetwork": "network", "counterOffsetGroup": "offset"}
+    for tag in counter_tags:
+        pairs = cmds.listConnections([pivot + "." + tag for pivot in pivots], s=1, d=0, c=1, p=0) or []
+        for (plug, node) in zip(pairs[::2], pairs[1::2]):
+            pivot_uuid = cmds.ls(plug.split(".")[0], uuid=1)[0]
+            node_uuid = cmds.ls(node, uuid=1)[0]
+            if tag == "counterUtilityNodes":
+                rigs[pivot_uuid]["utilities"].append(node_uuid)
+            else:
+                rigs[pivot_uuid][keys[tag]] = node_uuid
+    return rigs
+
+''' Best guess at the rig of an untagged pivot group, from its connections '''
+def infer_rig(pivot):
+    children = cmds.listRelatives(pivot, c=1, type="transform", f=1)
+    if not children:
+        return None
+    obj = children[0]
+
+    utilities = []
+    pending = cmds.listConnections(pivot, s=1, d=0, type="plusMinusAverage") or []
+    pending += cmds.listConnections(pivot, s=1, d=0, type="multiplyDivide") or []
+    pending += cmds.listConnections(pivot, s=1, d=0, type="choice") or []
+    while pending:
+        node = pending.pop()
+        if node in utilities:
+            continue
+        utilities.append(node)
+        for node_type in ("plusMinusAverage", "multiplyDivide"):
+            pending += cmds.listConnections(node, s=1, d=0, type=node_type) or []
+
+    network = [nd for nd in (cmds.listConnections(obj + ".msg", s=0, d=1, type="network") or [])
+               if cmds.attributeQuery("historyConnection", node=nd, ex=1)]
+    offset = cmds.listRelatives(pivot, p=1, f=1)
+    offset = offset if offset and offset[0].split("|")[-1].split(":")[-1].startswith("grp_counter_offset_") else None
+
+    options = default_counter_options()
+    options["rotation"] = bool(cmds.listConnections(pivot + ".rotate", s=1, d=0))
+    if network:
+        options["translation"] = (cmds.attributeQuery("translateCounterBlend", node=network[0], ex=1) or
+                                  cmds.attributeQuery("translateOffset", node=network[0], ex=1))
+        options["addBlends"] = (cmds.attributeQuery("translateCounterBlend", node=network[0], ex=1) or
+                                cmds.attributeQuery("rotateCounterBlend", node=network[0], ex=1))
+    else:
+        options["addBlends"] = False
+    options["addOffsets"] = bool(offset) or bool(network and cmds.attributeQuery("translateOffset", node=network[0], ex=1))
+    options["maintainOffsets"] = options["addOffsets"]
+
+    return {"pivot": cmds.ls(pivot, uuid=1)[0], "object": cmds.ls(obj, uuid=1)[0],
+            "network": cmds.ls(network[0], uuid=1)[0] if network else None,
+            "offset": cmds.ls(offset[0], uuid=1)[0] if offset else None,
+            "utilities": cmds.ls(utilities, uuid=1) or [], "options": options, "values": None}
+
+'''
+A rig's stored options, overridden by counterTransform arguments. Stored
+options always include maintainOffsets, so it's dropped when addOffsets is
+overridden alone, letting maintainOffsets follow addOffsets as in counterTransform.
+'''
+def rebuild_options(rig, overrides):
+    options = dict(rig["options"])
+    if "addOffsets" in overrides and "maintainOffsets" not in overrides:
+        options.pop("maintainOffsets", None)
+    options.update(overrides)
+    return options
+
+def default_counter_options():
+    return {"rotation": True, "translation": True, "addBlends": True, "addOffsets": True,
+            "maintainOffsets": True, "hideUtilityNodes": True}
+
+def resolve_node(uuid):
+    nodes = cmds.ls(uuid, l=1) if uuid else None
+    return nodes[0] if nodes else None
+
+''' Rig with node uuids resolved to current paths '''
+def resolve_rig(rig):
+    resolved = dict(rig)
+    for key in ("pivot", "object", "network", "offset"):
+        resolved[key] = resolve_node(rig[key])
+    resolved["utilities"] = [resolve_node(uuid) for uuid in rig["utilities"]]
+    return resolved
+
+''' Finds the rigs that any of the given nodes belong to, resolved to paths unless resolve is False '''
+def find_counter_rigs(nodes, resolve=True):
+    update_counter_index()
+
+    pivots = set(counter_members.get(uuid) for uuid in cmds.ls(nodes, uuid=1) or [])
+    rigs = [counter_index[pivot] for pivot in pivots if pivot in counter_index]
+    return [resolve_rig(rig) if resolve else dict(rig) for rig in rigs]
+
+'''
+Deletes a rig, undoing what counterTransform did: its object is parented back
+under the rig's parent (relatively), and the zeroed values (or the network's
+offsets) are moved back into the object's channels. Returns the object's new path.
+'''
+def remove_counter_rig(rig):
+    pivot_uuid = cmds.ls(rig["pivot"], uuid=1)[0] if rig["pivot"] else None
+    obj = rig["object"]
+    top = rig["offset"] or rig["pivot"]
+    if obj and top:
+        prnt = cmds.listRelatives(top, p=1, f=1)
+        obj_uuid = cmds.ls(obj, uuid=1)[0]
+        offsets = dict(rig.get("values") or {})
+        offsets.update(counter_offsets(rig))
+        if prnt:
+            cmds.parent(obj, prnt[0], r=1)
+        else:
+            cmds.parent(obj, w=1, r=1)
+        obj = resolve_node(obj_uuid)
+
+        # counterTransform only zeroed settable channels
+        for (attr, offset) in sorted(offsets.items()):
+            if offset and cmds.getAttr(obj + "." + attr, se=1):
+                cmds.setAttr(obj + "." + attr, cmds.getAttr(obj + "." + attr) + offset)
+
+    nodes = [nd for nd in [rig["pivot"], rig["offset"], rig["network"]] + rig["utilities"] if nd and cmds.objExists(nd)]
+    if nodes:
+        cmds.delete(nodes)
+    unindex_rig(pivot_uuid)
+    return obj
+
+'''
+Offsets stored on a rig's network, as (object channel, value) pairs. Translate
+offsets of rigs that counter rotation include the object's pivot, which is
+taken back out.
+'''
+def counter_offsets(rig):
+    (network, obj, options) = (rig["network"], rig["object"], rig["options"])
+    offsets = []
+    if network and options["translation"] and cmds.attributeQuery("translateOffset", node=network, ex=1):
+        values = cmds.getAttr(network + ".to")[0]
+        if options["rotation"]:
+            values = [v - p - t for (v, p, t) in zip(values, cmds.getAttr(obj + ".rotatePivot")[0],
+                                                     cmds.getAttr(obj + ".rotatePivotTranslate")[0])]
+        offsets += zip(("tx", "ty", "tz"), values)
+    if network and options["rotation"] and cmds.attributeQuery("rotateOffset", node=network, ex=1):
+        offsets += zip(("rx", "ry", "rz"), cmds.getAttr(network + ".ro")[0])
+    return offsets
+
+def install_counter_callbacks():
+    if counter_index_state["callbacks"]:
+        return
+
+    # Only pivot groups are tracked. Other rig nodes that are removed simply stop
+    # resolving (see resolve_rig), and resolve again if restored by undo.
+    def node_added(node, *args):
+        fn = om.MFnDependencyNode(node)
+        name = fn.name().split(":")[-1]
+        if fn.hasAttribute("counterObject") or (name.startswith("grp_counter_") and not name.startswith("grp_counter_offset_")):
+            counter_index_state["added"].add(fn.uuid().asString())
+    def node_removed(node, *args):
+        uuid = om.MFnDependencyNode(node).uuid().asString()
+        counter_index_state["added"].discard(uuid)
+        if uuid in counter_index:
+            unindex_rig(uuid)
+    def scene_changed(*args):
+        counter_index_state["dirty"] = True
+
+    counter_index_state["callbacks"] = [
+        om.MDGMessage.addNodeAddedCallback(node_added, "transform"),
+        om.MDGMessage.addNodeRemovedCallback(node_removed, "dependNode"),
+        om.MSceneMessage.addCallback(om.MSceneMessage.kAfterOpen, scene_changed),
+        om.MSceneMessage.addCallback(om.MSceneMessage.kAfterNew, scene_changed),
+        om.MSceneMessage.addCallback(om.MSceneMessage.kAfterImport, scene_changed),
+        om.MSceneMessage.addCallback(om.MSceneMessage.kAfterLoadReference, scene_changed)]
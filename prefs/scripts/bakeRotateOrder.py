@@ -8,10 +8,18 @@ world rotation OR the world rotation of any rotation keys. Note that this
 requires a certain degree of baking (using 'smart' bake), so that single
 channel keys will necessarily become 3 channel keys (ie rx, ry, rz). In
 addition, tangent behaviour may be difficult to gaurantee.
+
+Also includes an analysis mode that recommends a rotation order for each
+control, by sampling its rotation over the playback range and scoring all six
+orders at once by proximity to gimbal lock and by curve smoothness.
 '''
 
+import numpy as np
 import maya.cmds as cmds
+import maya.api.OpenMaya as om
 from queryMousePosition import queryMousePosition
+from keyReductionTools import reduceKeys
+from jobScheduler import queueJob
 
 rotateOrderList = ['xyz', 'yzx', 'zxy', 'xzy', 'yxz', 'zyx']
 
@@ -28,6 +36,15 @@ def bakeRotateOrderTool():
             roi = rotateOrderList.index(ro)
             cmds.deleteUI(window, window=1)
             bakeRotateOrder(roi)
+        elif ro == "best":
+            cmds.deleteUI(window, window=1)
+            bakeBestRotateOrder()
+    def analyzeAction(*args):
+        cmds.textScrollList(results, e=1, ra=1)
+        for (obj, ranking) in analyzeRotateOrders().items():
+            cmds.textScrollList(results, e=1, a=obj.split("|")[-1] + ": " +
+                                ", ".join("%s (%.2f)" % (rotateOrderList[roi], score) for (roi, score) in ranking))
+        cmds.textScrollList(results, e=1, vis=1)
 
     cmds.columnLayout(cat=("both",0), adj=1)
     menu = cmds.optionMenu(label="Rotate Order", cc=bakeAction)
@@ -35,40 +52,206 @@ def bakeRotateOrderTool():
     cmds.menuItem(label="---")
     for ro in rotateOrderList:
         cmds.menuItem(label=ro)
+    cmds.menuItem(label="best")
 
+    cmds.button(label="Analyze", c=analyzeAction)
+    results = cmds.textScrollList(h=100, vis=0)
     cmds.button(label="Cancel", c=closeAction)
 
     cmds.showWindow( window )
 
-''' Actual script to change the rotation order '''
-def bakeRotateOrder(new_rotate_order, *args):
+'''
+Actual script to change the rotation order.
+    reduceTolerance=[float] - If provided, baked curves are reduced (see keyReductionTools.reduceKeys) to this tolerance in degrees.
+'''
+def bakeRotateOrder(new_rotate_order, *args, **kwargs):
     objs = cmds.ls(sl=1) if not args else args
+    reduce_tolerance = kwargs.pop("reduceTolerance", None)
+    if kwargs:
+        raise TypeError("Invalid flag %s" % kwargs.keys()[0])
 
     cur_time = cmds.currentTime(q=1)
     time_range = (cmds.playbackOptions(q=1, min=1), cmds.playbackOptions(q=1, max=1))
 
+    baked = []
     for obj in objs:
-        if cmds.getAttr(obj + ".rotateOrder", se=1):
-            prnt = cmds.listRelatives(obj, p=1, f=1)
-            skip_rot = [r for r in "xyz" if not cmds.getAttr(obj + ".r" + r, se=1)]
-            target_rot = ["r" + r for r in "xyz" if r not in skip_rot]
+        baked.extend(bake_object(obj, new_rotate_order, time_range))
+
+    if reduce_tolerance is not None and baked:
+        reduceKeys(*baked, tolerance=reduce_tolerance)
+
+    cmds.currentTime(cur_time)
+    cmds.select(objs)
+
+'''
+Same as bakeRotateOrder, but queued on the job scheduler (see jobScheduler)
+instead of blocking, one object per step. Returns the job.
+'''
+def bakeRotateOrderJob(new_rotate_order, *args, **kwargs):
+    objs = cmds.ls(sl=1) if not args else args
+    reduce_tolerance = kwargs.pop("reduceTolerance", None)
+    if kwargs:
+        raise TypeError("Invalid flag %s" % kwargs.keys()[0])
+    return queueJob("Bake rotate order", bake_rotate_order_steps(new_rotate_order, objs, reduce_tolerance))
+
+'''
+Scores all six rotation orders for each object (or selection) over the playback
+range. Returns a dictionary of object -> list of (rotate order index, score),
+best (lowest score) first. The score is the gimbal term (0 to 1, how close the
+middle axis gets to +-90 degrees) plus the smoothness term (mean frame to frame
+change in angular velocity, in radians) weighted by smoothWeight.
+'''
+def analyzeRotateOrders(*args, **kwargs):
+    objs = cmds.ls(sl=1, l=1) if not args else cmds.ls(args, l=1)
+    smooth_weight = kwargs.pop("smoothWeight", 1.0)
+    if kwargs:
+        raise TypeError("Invalid flag %s" % kwargs.keys()[0])
 
-            loc = cmds.spaceLocator()[0]
-            if prnt:
-                loc = cmds.parent(loc, prnt, r=1)[0]
+    objs = [obj for obj in objs if cmds.attributeQuery("rotateOrder", node=obj, ex=1)]
+    if not objs:
+        return {}
 
-            cmds.setAttr(loc + ".rotateOrder", new_rotate_order)
-            orient_constraint1 = cmds.orientConstraint(obj, loc)
-            cmds.bakeResults(loc, at=["rx", "ry", "rz"], t=time_range, sm=1, smart=1, dic=1)
+    frames = np.arange(cmds.playbackOptions(q=1, min=1), cmds.playbackOptions(q=1, max=1) + 1)
+    angles = sample_rotations(objs, frames)
+    orders = np.array([cmds.getAttr(obj + ".rotateOrder") for obj in objs])
 
-            cmds.cutKey(obj, at=target_rot, cl=1)
-            cmds.setAttr(obj + ".rotateOrder", new_rotate_order)
-            orient_constraint2 = cmds.orientConstraint(loc, obj, sk = skip_rot)
+    scores = scoreRotateOrders(angles, orders, smooth_weight)
+    return dict((obj, [(int(roi), float(scores[i, roi])) for roi in np.argsort(scores[i])]) for (i, obj) in enumerate(objs))
 
-            cmds.bakeResults(obj, at=target_rot, t=time_range, sm=1, smart=1, dic=1)
-            cmds.delete(loc)
-        else:
-            print "Error: Rotate order attribute on object", obj, "is not setable"
+''' Bakes each object (or selection) to the rotation order recommended by analyzeRotateOrders. Takes the same flags as bakeRotateOrder. '''
+def bakeBestRotateOrder(*args, **kwargs):
+    objs = cmds.ls(sl=1, l=1) if not args else cmds.ls(args, l=1)
 
-    cmds.currentTime(cur_time)
+    by_order = {}
+    for (obj, ranking) in analyzeRotateOrders(*objs).items():
+        if ranking[0][0] != cmds.getAttr(obj + ".rotateOrder"):
+            by_order.setdefault(ranking[0][0], []).append(obj)
+
+    for (roi, order_objs) in by_order.items():
+        print "Baking %d objects to rotate order %s" % (len(order_objs), rotateOrderList[roi])
+        bakeRotateOrder(roi, *order_objs, **kwargs)
     cmds.select(objs)
+
+'''
+Scores every rotation order for sampled rotations. Takes an array of euler
+angles in radians shaped (objects, samples, 3), and the current rotate order
+index of each object. Returns scores shaped (objects, 6), lower is better.
+'''
+def scoreRotateOrders(angles, orders, smooth_weight=1.0):
+    angles = np.asarray(angles, dtype=float)
+    orders = np.asarray(orders)
+
+    matrices = np.empty(angles.shape[:-1] + (3, 3))
+    for roi in xrange(len(rotateOrderList)):
+        mask = orders == roi
+        if mask.any():
+            matrices[mask] = euler_to_matrix(angles[mask], roi)
+
+    scores = np.empty((angles.shape[0], len(rotateOrderList)))
+    for roi in xrange(len(rotateOrderList)):
+        converted = matrix_to_euler(matrices, roi)
+        middle = converted[..., "xyz".index(rotateOrderList[roi][1])]
+        gimbal = 1.0 - np.abs(np.cos(middle))
+        gimbal = (gimbal.mean(axis=1) + gimbal.max(axis=1)) / 2.0
+
+        smoothness = np.zeros(angles.shape[0])
+        if angles.shape[1] > 2:
+            unwrapped = np.unwrap(converted, axis=1)
+            smoothness = np.abs(np.diff(unwrapped, n=2, axis=1)).sum(axis=2).mean(axis=1)
+
+        scores[:, roi] = gimbal + smooth_weight * smoothness
+    return scores
+
+##
+## INTERNAL
+##
+
+'''
+Samples every object's rotate (radians) at each frame. Time is stepped once
+per frame without refreshing, and all objects are read through their plugs at
+that time. Returns an array shaped (objects, frames, 3).
+'''
+def sample_rotations(objs, frames):
+    sel = om.MSelectionList()
+    for obj in objs:
+        sel.add(obj + ".rotate")
+    plugs = [sel.getPlug(i) for i in xrange(sel.length())]
+    plugs = [[plug.child(axis) for axis in xrange(3)] for plug in plugs]
+
+    angles = np.empty((len(objs), len(frames), 3))
+    cur_time = cmds.currentTime(q=1)
+    try:
+        for (f, frame) in enumerate(frames):
+            cmds.currentTime(frame, u=0)
+            angles[:, f] = [[axis.asMAngle().asRadians() for axis in plug] for plug in plugs]
+    finally:
+        cmds.currentTime(cur_time)
+    return angles
+
+''' Bakes one object to a new rotate order, returns the baked rotate attributes '''
+def bake_object(obj, new_rotate_order, time_range):
+    if cmds.getAttr(obj + ".rotateOrder", se=1):
+        prnt = cmds.listRelatives(obj, p=1, f=1)
+        skip_rot = [r for r in "xyz" if not cmds.getAttr(obj + ".r" + r, se=1)]
+        target_rot = ["r" + r for r in "xyz" if r not in skip_rot]
+
+        loc = cmds.spaceLocator()[0]
+        if prnt:
+            loc = cmds.parent(loc, prnt, r=1)[0]
+
+        cmds.setAttr(loc + ".rotateOrder", new_rotate_order)
+        orient_constraint1 = cmds.orientConstraint(obj, loc)
+        cmds.bakeResults(loc, at=["rx", "ry", "rz"], t=time_range, sm=1, smart=1, dic=1)
+
+        cmds.cutKey(obj, at=target_rot, cl=1)
+        cmds.setAttr(obj + ".rotateOrder", new_rotate_order)
+        orient_constraint2 = cmds.orientConstraint(loc, obj, sk = skip_rot)
+
+        cmds.bakeResults(obj, at=target_rot, t=time_range, sm=1, smart=1, dic=1)
+        cmds.delete(loc)
+        return [obj + "." + attr for attr in target_rot]
+    else:
+        print "Error: Rotate order attribute on object", obj, "is not setable"
+        return []
+
+''' Job steps for bakeRotateOrderJob '''
+def bake_rotate_order_steps(new_rotate_order, objs, reduce_tolerance):
+    cur_time = cmds.currentTime(q=1)
+    time_range = (cmds.playbackOptions(q=1, min=1), cmds.playbackOptions(q=1, max=1))
+
+    baked = []
+    try:
+        for (i, obj) in enumerate(objs):
+            baked.extend(bake_object(obj, new_rotate_order, time_range))
+            yield float(i + 1) / (len(objs) + (reduce_tolerance is not None))
+
+        if reduce_tolerance is not None and baked:
+            reduceKeys(*baked, tolerance=reduce_tolerance)
+    finally:
+        cmds.currentTime(cur_time)
+
+def axis_rotations(axis, a):
+    (c, s, o, z) = (np.cos(a), np.sin(a), np.ones_like(a), np.zeros_like(a))
+    if axis == 0:
+        m = [[o, z, z], [z, c, -s], [z, s, c]]
+    elif axis == 1:
+        m = [[c, z, s], [z, o, z], [-s, z, c]]
+    else:
+        m = [[c, -s, z], [s, c, z], [z, z, o]]
+    return np.moveaxis(np.array(m), (0, 1), (-2, -1))
+
+''' Euler angles (..., 3) to (column vector) rotation matrices (..., 3, 3), first axis of the order applied first '''
+def euler_to_matrix(angles, roi):
+    (i, j, k) = ["xyz".index(axis) for axis in rotateOrderList[roi]]
+    m = np.einsum("...ij,...jk->...ik", axis_rotations(k, angles[..., k]), axis_rotations(j, angles[..., j]))
+    return np.einsum("...ij,...jk->...ik", m, axis_rotations(i, angles[..., i]))
+
+''' Inverse of euler_to_matrix '''
+def matrix_to_euler(m, roi):
+    (i, j, k) = ["xyz".index(axis) for axis in rotateOrderList[roi]]
+    sign = 1.0 if (j - i) % 3 == 1 else -1.0
+    angles = np.empty(m.shape[:-2] + (3,))
+    angles[..., j] = np.arcsin(np.clip(-sign * m[..., k, i], -1.0, 1.0))
+    angles[..., i] = np.arctan2(sign * m[..., k, j], m[..., k, k])
+    angles[..., k] = np.arctan2(sign * m[..., j, i], m[..., i, i])
+    return angles
@@ -0,0 +1,218 @@
+# Copyright 2022 by Kyle Joswiak
+#
+# This is released under the "MIT License Agreement".
+# See License file that should have been included in distribution.
+'''
+Headless batch runner. Applies a toolbox function to many scene files, each in
+its own standalone maya process (mayapy), several at a time. Every worker opens
+its file, applies the function, saves, and reports timing and errors back.
+
+Usage:
+    mayapy batchRunner.py job.json [--workers N] [--retries N] [--timeout SECONDS] [--report report.json]
+    mayapy batchRunner.py job.json --retry report.json   (only reruns the files that failed)
+    mayapy batchRunner.py job.json --only shot010.ma shot020.ma   (merged into the existing report)
+
+Job spec (json):
+    {
+        "files": ["shot010.ma", "shot020.ma"],
+        "module": "bakeRotateOrder",
+        "function": "bakeRotateOrder",
+        "args": [2],
+        "kwargs": {"reduceTolerance": 0.01},
+        "select": ["*:ctrl_arm_L"],  (optional, selected before the call)
+        "save": true,                (optional, default true)
+        "timeout": 600,              (optional, seconds per file attempt, default none)
+        "mayapy": "/path/to/mayapy"  (optional, default $MAYAPY or mayapy)
+    }
+'''
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from multiprocessing.pool import ThreadPool
+
+RESULT_PREFIX = "BATCH_RESULT "
+
+'''
+Runs a job over its files, with up to workers files in flight at once. Each
+file is attempted up to retries+1 times. only limits the run to those files.
+run_file(job, path) does the actual work and returns a result dictionary with
+at least "ok" (and "error" on failure); it defaults to launching a mayapy
+worker process, but any callable (ie a cmds stand-in) can be used.
+Returns a dictionary of file -> result, with "attempts" and "elapsed" added.
+'''
+def runBatch(job, workers=4, retries=1, only=None, run_file=None):
+    files = [path for path in job["files"] if only is None or path in only]
+    run_file = run_file or run_worker_process
+
+    def attempt(path):
+        for n in xrange(retries + 1):
+            start = time.time()
+            try:
+                result = run_file(job, path)
+            except Exception:
+                result = {"ok": False, "error": traceback.format_exc()}
+            result["file"] = path
+            result["attempts"] = n + 1
+            result["elapsed"] = time.time() - start
+            if result.get("ok"):
+                break
+        return result
+
+    pool = ThreadPool(max(1, min(workers, len(files) or 1)))
+    try:
+        results = pool.map(attempt, files)
+    finally:
+        pool.close()
+        pool.join()
+    return dict((result["file"], result) for result in results)
+
+''' Returns the files that failed in a previous report '''
+def failedFiles(report):
+    return [path for (path, result) in report.items() if not result.get("ok")]
+
+''' Prints a summary of a report, one line per file '''
+def printReport(report):
+    for path in sorted(report):
+        result = report[path]
+        if result.get("ok"):
+            timings = ", ".join("%s %.1fs" % (step, result["timings"][step]) for step in ("open", "apply", "save") if step in result.get("timings", {}))
+            print "OK      %s (%.1fs, %s)" % (path, result["elapsed"], timings)
+        else:
+            error = result.get("error", "").strip().splitlines()
+            print "FAILED  %s (%d attempts): %s" % (path, result["attempts"], error[-1] if error else "")
+    print "%d of %d files succeeded" % (len(report) - len(failedFiles(report)), len(report))
+
+##
+## INTERNAL
+##
+
+'''
+Runs one file in a new mayapy process, and reads its result back from stdout.
+A worker still running after the job's timeout (ie stuck on a dialog or a
+license) is killed, and the attempt fails.
+'''
+def run_worker_process(job, path):
+    mayapy = job.get("mayapy") or os.environ.get("MAYAPY") or "mayapy"
+    # Own process group, so a timeout also kills what the mayapy wrapper launched
+    process = subprocess.Popen([mayapy, os.path.abspath(__file__), "--worker", path],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               preexec_fn=os.setsid if os.name == "posix" else None)
+
+    timed_out = []
+    def kill():
+        # The worker may have finished just as the timer fired
+        if process.poll() is not None:
+            return
+        try:
+            if os.name == "posix":
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                subprocess.call(["taskkill", "/F", "/T", "/PID", str(process.pid)])
+        except OSError:
+            return
+        timed_out.append(True)
+    timer = threading.Timer(job["timeout"], kill) if job.get("timeout") else None
+    if timer:
+        timer.start()
+    try:
+        (output, _) = process.communicate(json.dumps(job))
+    finally:
+        if timer:
+            timer.cancel()
+
+    if timed_out:
+        return {"ok": False, "error": "%s\nWorker killed after timing out (%gs)" % (output[-2000:], job["timeout"])}
+
+    for line in reversed(output.splitlines()):
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    return {"ok": False, "error": "Worker exited with code %d without a result:\n%s" % (process.returncode, output[-2000:])}
+
+''' Worker side: opens, applies and saves a single file inside standalone maya '''
+def run_in_maya(job, path):
+    import maya.standalone
+    maya.standalone.initialize(name="python")
+    import maya.cmds as cmds
+
+    # Make the rest of the toolbox importable
+    scripts = os.path.dirname(os.path.abspath(__file__))
+    if scripts not in sys.path:
+        sys.path.insert(0, scripts)
+
+    timings = {}
+    start = time.time()
+    cmds.file(path, o=1, f=1)
+    timings["open"] = time.time() - start
+
+    start = time.time()
+    if job.get("select"):
+        cmds.select(job["select"])
+    module = __import__(job["module"])
+    getattr(module, job["function"])(*job.get("args", []), **job.get("kwargs", {}))
+    timings["apply"] = time.time() - start
+
+    if job.get("save", True):
+        start = time.time()
+        cmds.file(save=1, f=1)
+        timings["save"] = time.time() - start
+
+    return {"ok": True, "timings": timings}
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Apply a toolbox function to many scene files in parallel.")
+    parser.add_argument("job", nargs="?", help="Job spec (json)")
+    parser.add_argument("--workers", type=int, default=4, help="Number of files processed at once")
+    parser.add_argument("--retries", type=int, default=1, help="Extra attempts for files that fail")
+    parser.add_argument("--timeout", type=float, default=None, help="Seconds before a worker is killed (overrides the job spec)")
+    parser.add_argument("--report", default=None, help="Where to write the json report")
+    parser.add_argument("--retry", default=None, help="Previous report, only its failed files are rerun")
+    parser.add_argument("--only", nargs="+", default=None, help="Only run these files")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        job = json.loads(sys.stdin.read())
+        try:
+            result = run_in_maya(job, args.worker)
+        except Exception:
+            result = {"ok": False, "error": traceback.format_exc()}
+        sys.stdout.write(RESULT_PREFIX + json.dumps(result) + "\n")
+        sys.stdout.flush()
+        # Skip standalone teardown, which can be slow
+        os._exit(0)
+
+    if not args.job:
+        parser.error("a job spec is required")
+    with open(args.job) as f:
+        job = json.load(f)
+    if args.timeout:
+        job["timeout"] = args.timeout
+
+    # Partial runs (--retry or --only) are merged into the existing report, rather than replacing it
+    report_path = args.report or args.retry or os.path.splitext(args.job)[0] + "_report.json"
+    report = {}
+    only = args.only
+    if args.retry:
+        with open(args.retry) as f:
+            report = json.load(f)
+        only = failedFiles(report)
+    elif only and os.path.exists(report_path):
+        with open(report_path) as f:
+            report = json.load(f)
+
+    report.update(runBatch(job, args.workers, args.retries, only))
+    printReport(report)
+
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=4, sort_keys=True)
+    return 0 if not failedFiles(report) else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,223 @@
+# Copyright 2022 by Kyle Joswiak
+#
+# This is released under the "MIT License Agreement".
+# See License file that should have been included in distribution.
+'''
+Cooperative job scheduler, so long running tools don't freeze the UI. A job is
+a generator, and every yield ends a step:
+    yield 0.5                   - Reports progress (0 to 1).
+    x = yield background(f, a)  - Runs f(a) on a worker thread, and resumes the
+                                  job with its result (or raises its exception)
+                                  once done. Only pure computation belongs there,
+                                  scene edits stay in the job itself.
+Steps run on the main thread during Maya's idle time, as many as fit in the
+time budget of each idle event. Jobs run one at a time, in the order queued.
+
+No undo chunk is held open while a job runs. Instead each step's commands are
+captured as one reversible unit (see apiUndo.runAsUnit), and once the job
+finishes (or is cancelled, or fails) its units are registered as a single
+undoable command. Edits made by hand in the meantime stay separate. Undo or
+redo while a job is running cancels it, as its remaining steps would run
+against a scene that no longer matches what it has already read. New scene
+or scene open cancels every job.
+'''
+
+import sys
+import time
+import traceback
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import maya.cmds as cmds
+import maya.mel as mel
+import maya.api.OpenMaya as om
+
+from apiUndo import runAsUnit, undoableUnits
+
+'''
+Queues a job, and starts the scheduler if it isn't running.
+    name=[string] - Shown in the progress bar and reports.
+    steps=[generator] - The job's steps, see above.
+Returns the job, which can be passed to cancelJob.
+'''
+def queueJob(name, steps):
+    job = Job(name, steps)
+    job_queue.append(job)
+    start_scheduler()
+    return job
+
+''' Cancels a job (default is the running job). Steps already run are kept, and undo as one. '''
+def cancelJob(job=None):
+    job = job or (job_queue[0] if job_queue else None)
+    if job in job_queue:
+        finish_job(job, "cancelled")
+
+''' Cancels the running job and every queued job '''
+def cancelAllJobs():
+    for job in reversed(job_queue[:]):
+        finish_job(job, "cancelled")
+
+''' Returns the running and queued jobs as (name, state, progress) '''
+def jobQueue():
+    return [(job.name, job.state, job.progress) for job in job_queue]
+
+''' Seconds of work done per idle event. Lower keeps the UI more responsive, higher finishes sooner. '''
+def setSliceBudget(seconds):
+    scheduler_state["budget"] = max(float(seconds), 0.001)
+
+''' Wraps a function call to be run on a worker thread. Yield it from a job. '''
+def background(fn, *args, **kwargs):
+    return Background(fn, args, kwargs)
+
+class Job(object):
+    def __init__(self, name, steps):
+        self.name = name
+        self.steps = steps
+        self.state = "queued"
+        self.progress = 0.0
+        self.error = None
+        self.elapsed = 0.0
+        self.pending = None
+        self.units = []
+
+class Background(object):
+    def __init__(self, fn, args, kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+##
+## INTERNAL
+##
+
+job_queue = []
+scheduler_state = {"idle_job": None, "undo_jobs": [], "callbacks": [], "pool": None, "progress": None, "budget": 0.05}
+
+def start_scheduler():
+    if scheduler_state["idle_job"] is None or not cmds.scriptJob(ex=scheduler_state["idle_job"]):
+        scheduler_state["idle_job"] = cmds.scriptJob(idleEvent=run_slice)
+    if not scheduler_state["undo_jobs"]:
+        scheduler_state["undo_jobs"] = [cmds.scriptJob(e=[event, cancel_on_undo]) for event in ("Undo", "Redo")]
+    if not scheduler_state["callbacks"]:
+        scheduler_state["callbacks"] = [om.MSceneMessage.addCallback(message, discard_on_scene_change)
+                                        for message in (om.MSceneMessage.kBeforeNew, om.MSceneMessage.kBeforeOpen)]
+
+def stop_scheduler():
+    script_jobs = [scheduler_state["idle_job"]] + scheduler_state["undo_jobs"]
+    scheduler_state["idle_job"] = None
+    scheduler_state["undo_jobs"] = []
+    if scheduler_state["callbacks"]:
+        om.MMessage.removeCallbacks(scheduler_state["callbacks"])
+        scheduler_state["callbacks"] = []
+    # Killing the running scriptJob from inside itself has to wait until it returns
+    def kill():
+        for script_job in script_jobs:
+            if script_job is not None and cmds.scriptJob(ex=script_job):
+                cmds.scriptJob(kill=script_job, f=1)
+    cmds.evalDeferred(kill)
+
+def cancel_on_undo():
+    if job_queue and job_queue[0].state == "running":
+        sys.stderr.write("Undo/redo while job '%s' was running, cancelling it\n" % job_queue[0].name)
+        finish_job(job_queue[0], "cancelled")
+
+''' The scene the jobs work on is going away, their edits go with it '''
+def discard_on_scene_change(*args):
+    for job in reversed(job_queue[:]):
+        finish_job(job, "cancelled", discard=True)
+
+def worker_pool():
+    if scheduler_state["pool"] is None:
+        scheduler_state["pool"] = ThreadPool(max(1, multiprocessing.cpu_count() - 1))
+    return scheduler_state["pool"]
+
+''' Runs steps of the current job until the time budget is used up, or the job waits on a worker thread '''
+def run_slice():
+    start = time.time()
+    while job_queue and time.time() - start < scheduler_state["budget"]:
+        job = job_queue[0]
+        if job.state == "queued":
+            start_job(job)
+
+        progress = scheduler_state["progress"]
+        if progress and cmds.progressBar(progress, q=1, ic=1):
+            finish_job(job, "cancelled")
+            continue
+        if job.pending is not None and not job.pending.ready():
+            break
+
+        step_start = time.time()
+        if job.pending is not None:
+            pending = job.pending
+            job.pending = None
+            try:
+                result = pending.get()
+            except Exception:
+                exc_info = sys.exc_info()
+                advance = lambda: job.steps.throw(*exc_info)
+            else:
+                advance = lambda: job.steps.send(result)
+        else:
+            advance = lambda: next(job.steps)
+
+        (unit, step, exc_info) = runAsUnit(advance)
+        job.units.append(unit)
+        job.elapsed += time.time() - step_start
+        if exc_info and issubclass(exc_info[0], StopIteration):
+            finish_job(job, "done")
+            continue
+        elif exc_info:
+            job.error = "".join(traceback.format_exception(*exc_info))
+            finish_job(job, "failed")
+            continue
+
+        if isinstance(step, Background):
+            job.pending = worker_pool().apply_async(step.fn, step.args, step.kwargs)
+        elif step is not None:
+            job.progress = min(max(float(step), 0.0), 1.0)
+            if progress:
+                cmds.progressBar(progress, e=1, pr=int(job.progress * 100))
+
+    if not job_queue:
+        stop_scheduler()
+
+def start_job(job):
+    job.state = "running"
+    if not cmds.about(batch=1):
+        progress = mel.eval("$tmp = $gMainProgressBar")
+        remaining = len(job_queue) - 1
+        status = job.name + (" (%d more queued)" % remaining if remaining else "")
+        cmds.progressBar(progress, e=1, bp=1, ii=1, max=100, pr=0, status=status)
+        scheduler_state["progress"] = progress
+
+'''
+Ends a job, and registers the units of the steps it ran as one undoable
+command. With discard, the units are dropped instead (the scene is going away).
+'''
+def finish_job(job, state, discard=False):
+    running = job.state == "running"
+    job.state = state
+    job_queue.remove(job)
+    # A thread still working for a cancelled job finishes on its own, its result is dropped
+    job.pending = None
+
+    if discard or not running:
+        job.steps.close()
+    else:
+        # Closing runs the job's cleanup (finally blocks), which can edit the scene too
+        (unit, _, exc_info) = runAsUnit(job.steps.close)
+        job.units.append(unit)
+        if exc_info and not job.error:
+            job.error = "".join(traceback.format_exception(*exc_info))
+        undoableUnits(job.units)
+    job.units = []
+
+    if running:
+        if scheduler_state["progress"]:
+            cmds.progressBar(scheduler_state["progress"], e=1, ep=1)
+            scheduler_state["progress"] = None
+        if state == "failed":
+            sys.stderr.write("Job '%s' failed:\n%s" % (job.name, job.error))
+        else:
+            print "Job '%s' %s (%.2f seconds of main thread work)" % (job.name, state, job.elapsed)
+    if not job_queue:
+        stop_scheduler()
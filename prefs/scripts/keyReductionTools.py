@@ -0,0 +1,154 @@
+# Copyright 2022 by Kyle Joswiak
+#
+# This is released under the "MIT License Agreement".
+# See License file that should have been included in distribution.
+'''
+Error bounded key reduction, intended to be run after a bake. Each curve is
+sampled on every frame of its range, and rebuilt with the fewest keys (with
+fixed bezier tangents) needed to reproduce those samples within a tolerance.
+The fit runs on all curves at once, and the curves are rewritten through the
+API as a single undoable edit.
+'''
+
+import numpy as np
+import maya.cmds as cmds
+import maya.mel as mel
+import maya.api.OpenMaya as om
+import maya.api.OpenMayaAnim as oma
+
+from keySelectionTools import getActiveAnimationCurves
+from apiUndo import undoableEdit
+
+'''
+Reduces keys on animation curves. Curves are taken from arguments (objects or
+curves), or from the active curves (see keySelectionTools) if none provided.
+    tolerance=[float] - Maximum allowed deviation from the original curve on any frame,
+        in the curve's units (ie degrees for rotation). (default 0.01)
+Reduced curves are unweighted. Returns (keys before, keys after, max error).
+'''
+def reduceKeys(*args, **kwargs):
+    tolerance = kwargs.pop("tolerance", 0.01)
+    if kwargs:
+        raise TypeError("Invalid flag %s" % kwargs.keys()[0])
+
+    curves = cmds.keyframe(args, q=1, n=1) if args else getActiveAnimationCurves()
+    # Only time based curves can be refit
+    curves = [cv for cv in (curves or []) if cmds.nodeType(cv) in ("animCurveTA", "animCurveTL", "animCurveTU")]
+    curves = [cv for cv in curves if cmds.keyframe(cv, q=1, kc=1) > 2]
+    if not curves:
+        return (0, 0, 0.0)
+
+    sel = om.MSelectionList()
+    for cv in curves:
+        sel.add(cv)
+    fns = [oma.MFnAnimCurve(sel.getDependNode(i)) for i in xrange(sel.length())]
+    ui_time = om.MTime.uiUnit()
+
+    # Samples on every frame, plus the key times themselves (keys may be on subframes)
+    samples = []
+    for fn in fns:
+        key_times = [fn.input(k).asUnits(ui_time) for k in xrange(fn.numKeys)]
+        frames = np.union1d(np.arange(np.ceil(key_times[0]), np.floor(key_times[-1]) + 1), key_times)
+        samples.append((frames, [fn.evaluate(om.MTime(t, ui_time)) for t in frames]))
+
+    lengths = np.array([len(frames) for (frames, _) in samples])
+    n = lengths.max()
+    times = np.array([np.concatenate((frames, [frames[-1]] * (n - len(frames)))) for (frames, _) in samples])
+    values = np.array([values + [values[-1]] * (n - len(values)) for (_, values) in samples], dtype=float)
+
+    # Evaluated values are in internal units (radians, cm), the fit and tolerance are in ui units
+    scales = np.array([curve_unit_scale(fn) for fn in fns])
+    (keep, slopes, max_error) = fitKeys(times, values * scales[:, None], lengths, tolerance)
+    # Tangents are set in internal units per second
+    slopes = slopes * mel.eval("currentTimeUnitToFPS") / scales[:, None]
+
+    plans = []
+    for (i, fn) in enumerate(fns):
+        kept = np.flatnonzero(keep[i, :lengths[i]])
+        plans.append((fn, times[i, kept].tolist(), values[i, kept].tolist(), slopes[i, kept].tolist()))
+
+    def rebuild():
+        change = oma.MAnimCurveChange()
+        for (fn, key_times, key_values, key_slopes) in plans:
+            fn.setIsWeighted(False, change)
+            key_mtimes = om.MTimeArray()
+            for t in key_times:
+                key_mtimes.append(om.MTime(t, ui_time))
+            # Replaces all existing keys
+            fn.addKeys(key_mtimes, om.MDoubleArray(key_values), oma.MFnAnimCurve.kTangentFixed,
+                       oma.MFnAnimCurve.kTangentFixed, False, change)
+            for (k, slope) in enumerate(key_slopes):
+                fn.setTangent(k, 1.0, slope, True, change, False)
+                fn.setTangent(k, 1.0, slope, False, change, False)
+        return change.undoIt
+
+    before = sum(fn.numKeys for fn in fns)
+    undoableEdit(rebuild)
+    after = int(sum(len(key_times) for (_, key_times, _, _) in plans))
+    print "Reduced %d curves from %d to %d keys (max error %.4f)" % (len(curves), before, after, max_error)
+    return (before, after, max_error)
+
+'''
+Vectorized key fit. times and values are (curves, samples) arrays, padded past
+each curve's length (lengths). Keys are added at the worst sample of every
+segment that's out of tolerance, on all curves at once, until every sample is
+within tolerance of the cubic (hermite) curve through the kept keys, with
+tangents matching the samples' slope.
+Returns (keep mask, slopes in value per frame, max error).
+'''
+def fitKeys(times, values, lengths, tolerance):
+    times = np.asarray(times, dtype=float)
+    values = np.asarray(values, dtype=float)
+    lengths = np.asarray(lengths)
+    (count, n) = values.shape
+    rows = np.arange(count)[:, None]
+    idx = np.arange(n)
+    valid = idx < lengths[:, None]
+    last = lengths - 1
+
+    # Sample slopes, central where possible and one sided at the ends
+    before = np.maximum(idx - 1, 0)[None, :].repeat(count, axis=0)
+    after = np.minimum(idx[None, :] + 1, last[:, None])
+    dt = times[rows, after] - times[rows, before]
+    slopes = np.where(dt > 0, (values[rows, after] - values[rows, before]) / np.where(dt > 0, dt, 1), 0.0)
+
+    keep = np.zeros((count, n), dtype=bool)
+    keep[:, 0] = True
+    keep[np.arange(count), last] = True
+
+    while True:
+        prev = np.maximum.accumulate(np.where(keep, idx, 0), axis=1)
+        nxt = np.minimum.accumulate(np.where(keep, idx, n - 1)[:, ::-1], axis=1)[:, ::-1]
+        nxt = np.minimum(nxt, last[:, None])
+
+        (t0, t1) = (times[rows, prev], times[rows, nxt])
+        h = t1 - t0
+        s = np.where(h > 0, (times - t0) / np.where(h > 0, h, 1), 0.0)
+        (s2, s3) = (s * s, s * s * s)
+        fit = ((2*s3 - 3*s2 + 1) * values[rows, prev] + (s3 - 2*s2 + s) * h * slopes[rows, prev] +
+               (-2*s3 + 3*s2) * values[rows, nxt] + (s3 - s2) * h * slopes[rows, nxt])
+        error = np.where(valid, np.abs(fit - values), 0.0)
+
+        if not (error > tolerance).any():
+            return (keep, slopes, float(error.max()) if error.size else 0.0)
+
+        # Worst sample of every segment, for segments out of tolerance
+        segment = (rows * n + prev).ravel()
+        flat_error = error.ravel()
+        order = np.lexsort((-flat_error, segment))
+        first = np.ones(order.size, dtype=bool)
+        first[1:] = segment[order][1:] != segment[order][:-1]
+        worst = order[first]
+        keep.flat[worst[flat_error[worst] > tolerance]] = True
+
+##
+## INTERNAL
+##
+
+''' Scale from internal units to ui units of a curve's values (ie radians to degrees) '''
+def curve_unit_scale(fn):
+    if fn.animCurveType == oma.MFnAnimCurve.kAnimCurveTA:
+        return om.MAngle(1.0).asUnits(om.MAngle.uiUnit())
+    if fn.animCurveType == oma.MFnAnimCurve.kAnimCurveTL:
+        return om.MDistance(1.0).asUnits(om.MDistance.uiUnit())
+    return 1.0
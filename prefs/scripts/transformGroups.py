@@ -0,0 +1,158 @@
+# Copyright 2022 by Kyle Joswiak
+#
+# This is released under the "MIT License Agreement".
+# See License file that should have been included in distribution.
+'''
+Creates parent groups ("freeze" and "pivot" groups) for many objects at once.
+Group transforms are computed directly from world matrices (no constraints or
+world space reparenting), and every group is created, placed and reparented
+by one batch of API modifiers, undone as a single step.
+'''
+
+import time
+import maya.cmds as cmds
+import maya.api.OpenMaya as om
+
+from apiUndo import undoableEdit
+
+''' Create parent groups that non-destructively zero out each object's transform attributes '''
+def freezeGroup(*args):
+    objs = cmds.ls(sl=1, l=1) if not args else cmds.ls(args, l=1)
+
+    def placement(dag):
+        # Group takes over the object's local transform, object is zeroed
+        return (dag.inclusiveMatrix(), om.MMatrix())
+
+    return group_objects(objs, "frzGrp_", placement)
+
+''' Create parent groups that share each object's pivot (world position and orientation) '''
+def pivotGroup(*args):
+    objs = cmds.ls(sl=1, l=1) if not args else cmds.ls(args, l=1)
+
+    def placement(dag):
+        world = dag.inclusiveMatrix()
+        grp_world = om.MTransformationMatrix()
+        grp_world.setRotation(om.MTransformationMatrix(world).rotation(asQuaternion=True))
+        grp_world.setTranslation(om.MVector(om.MFnTransform(dag).rotatePivot(om.MSpace.kWorld)), om.MSpace.kWorld)
+        grp_world = grp_world.asMatrix()
+        return (grp_world, world * grp_world.inverse())
+
+    return group_objects(objs, "pvtGrp_", placement)
+
+##
+## INTERNAL
+##
+
+'''
+Groups each object under a new transform named prefix + object name. placement
+is called with each object's dag path, and returns (group world matrix, object
+local matrix once parented under the group). Every object keeps its world
+transform. Everything is done by two modifiers (one creates and reparents,
+one sets the channels), run as a single undoable edit.
+'''
+def group_objects(objs, prefix, placement):
+    objs = [obj for obj in objs if cmds.objectType(obj, isAType="transform")]
+    if not objs:
+        return []
+    start = time.time()
+
+    # Compute everything up front, from one pass over the dag
+    sel = om.MSelectionList()
+    for obj in objs:
+        sel.add(obj)
+    plans = []
+    for i in xrange(sel.length()):
+        dag = sel.getDagPath(i)
+        (grp_world, obj_local) = placement(dag)
+        grp_local = grp_world * dag.exclusiveMatrix().inverse()
+        prnt = om.MFnDagNode(dag).parent(0)
+        plans.append((dag.node(), prnt, prefix + dag.partialPathName().split("|")[-1], grp_local, obj_local))
+
+    # Objects are held as MObjects, which stay valid as earlier groups move them or their parents
+    dag_mod = om.MDagModifier()
+    grps = []
+    for (obj, prnt, name, grp_local, obj_local) in plans:
+        world = prnt.apiType() == om.MFn.kWorld
+        grp = dag_mod.createNode("transform", om.MObject.kNullObj if world else prnt)
+        dag_mod.renameNode(grp, name)
+        dag_mod.reparentNode(obj, grp)
+        # Like cmds.parent, a joint no longer under a joint stops compensating for its parent's scale
+        inverse_scale = om.MFnDependencyNode(obj).findPlug("inverseScale", False) if obj.hasFn(om.MFn.kJoint) else None
+        if inverse_scale is not None and inverse_scale.isDestination:
+            dag_mod.disconnect(inverse_scale.source(), inverse_scale)
+        grps.append(grp)
+
+    applied = []
+    def edit():
+        if applied:
+            dag_mod.doIt()
+            applied[0].doIt()
+        else:
+            dag_mod.doIt()
+            # Channels are set once the new groups exist
+            plug_mod = om.MDGModifier()
+            for ((obj, prnt, name, grp_local, obj_local), grp) in zip(plans, grps):
+                set_channels(plug_mod, grp, transform_channels(grp, grp_local))
+                set_channels(plug_mod, obj, joint_channels(obj, obj_local) if obj.hasFn(om.MFn.kJoint)
+                                            else transform_channels(obj, obj_local))
+            plug_mod.doIt()
+            applied.append(plug_mod)
+        def revert():
+            applied[0].undoIt()
+            dag_mod.undoIt()
+        return revert
+    undoableEdit(edit)
+
+    grps = [om.MFnDagNode(grp).fullPathName() for grp in grps]
+    elapsed = time.time() - start
+    print "Grouped %d objects in %.2f seconds (%.0f objects/second)" % (len(grps), elapsed, len(grps) / max(elapsed, 1e-6))
+
+    cmds.select(grps)
+    return grps
+
+'''
+Channel values giving a transform the local matrix, keeping its pivots, rotate
+axis and rotate order (the translation makes up for the pivots).
+'''
+def transform_channels(node, matrix):
+    wanted = om.MTransformationMatrix(matrix)
+    tm = om.MTransformationMatrix(om.MFnTransform(node).transformation())
+    tm.setScale(wanted.scale(om.MSpace.kTransform), om.MSpace.kTransform)
+    tm.setShear(wanted.shear(om.MSpace.kTransform), om.MSpace.kTransform)
+    tm.setRotation(tm.rotationOrientation().inverse() * wanted.rotation(asQuaternion=True))
+    tm.setTranslation(om.MVector(), om.MSpace.kTransform)
+    pivots = om.MTransformationMatrix(tm.asMatrix()).translation(om.MSpace.kTransform)
+    tm.setTranslation(wanted.translation(om.MSpace.kTransform) - pivots, om.MSpace.kTransform)
+    rotation = tm.rotation()
+    return {"translate": (tm.translation(om.MSpace.kTransform), False),
+            "rotate": ((rotation.x, rotation.y, rotation.z), True),
+            "scale": (tm.scale(om.MSpace.kTransform), False),
+            "shear": (tm.shear(om.MSpace.kTransform), False)}
+
+'''
+Channel values giving a joint the local matrix. The orientation goes into
+jointOrient with rotate zeroed, the rotate axis is kept.
+'''
+def joint_channels(node, matrix):
+    wanted = om.MTransformationMatrix(matrix)
+    rotate_axis = om.MFnTransform(node).rotateOrientation(om.MSpace.kTransform)
+    orient = (rotate_axis.inverse() * wanted.rotation(asQuaternion=True)).asEulerRotation()
+    return {"translate": (wanted.translation(om.MSpace.kTransform), False),
+            "rotate": ((0.0, 0.0, 0.0), True),
+            "jointOrient": ((orient.x, orient.y, orient.z), True),
+            "scale": (wanted.scale(om.MSpace.kTransform), False),
+            "shear": (wanted.shear(om.MSpace.kTransform), False),
+            "inverseScale": ((1.0, 1.0, 1.0), False)}
+
+''' Adds the channel values that differ from the node's current ones to modifier '''
+def set_channels(modifier, node, channels):
+    fn = om.MFnDependencyNode(node)
+    for (attr, (values, angle)) in channels.items():
+        plug = fn.findPlug(attr, False)
+        for i in xrange(3):
+            child = plug.child(i)
+            if angle:
+                if abs(child.asMAngle().asRadians() - values[i]) > 1e-9:
+                    modifier.newPlugValueMAngle(child, om.MAngle(values[i]))
+            elif abs(child.asDouble() - values[i]) > 1e-9:
+                modifier.newPlugValueDouble(child, values[i])
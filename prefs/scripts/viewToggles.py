@@ -3,6 +3,7 @@
 # This is released under the "MIT License Agreement".
 # See License file that should have been included in distribution.
 
+import math
 import maya.cmds as cmds
 
 ''' Variety of functions designed to be bound to hotkeys for quick and easy environment control. '''
@@ -63,8 +64,15 @@ def iterViewDisplayMode(dir):
         new_ordering = iter_ordering(ordering, cur_ordering, dir)
         cmds.modelEditor(cur_panel, e=1, da=new_ordering[0], dl=new_ordering[1], dtx=new_ordering[2])
 
-''' Toggles between smoothing levels '''
-def iterDisplaySmoothness(dir=None): #Currently this is a toggle
+'''
+Toggles between smoothing levels. If a budget (target viewport polygon count)
+is provided, toggles budget mode instead. See toggleSmoothnessBudget.
+'''
+def iterDisplaySmoothness(dir=None, budget=None): #Currently this is a toggle
+    if budget:
+        toggleSmoothnessBudget(budget)
+        return
+
     #ordering = [(0,0,4,1,1),(1,1,8,2,2),(3,3,16,4,3)]
     ordering = [(0,0,4,1,1),(3,3,16,4,3)]
 
@@ -81,6 +89,65 @@ def iterDisplaySmoothness(dir=None): #Currently this is a toggle
                                pointsShaded=new_settings[3],
                                polygonObject=new_settings[4])
 
+'''
+Budget driven smoothness. Assigns per-object smooth mesh preview levels so the
+visible meshes stay within a target polygon count, with the objects taking up
+the most screen space getting smoothed first. While active, levels are updated
+whenever the camera or selection changes. Call again to turn off (all visible
+meshes are returned to unsmoothed display).
+    budget=[int] - Target polygon count for the viewport.
+    maxLevel=[int] - Highest smooth mesh preview level to assign (default 3)
+'''
+def toggleSmoothnessBudget(budget, maxLevel=3):
+    global smoothness_budget_jobs, smoothness_budget_camera_jobs
+
+    if smoothness_budget_jobs:
+        for job in smoothness_budget_jobs + smoothness_budget_camera_jobs:
+            if cmds.scriptJob(ex=job):
+                cmds.scriptJob(kill=job, force=1)
+        smoothness_budget_jobs = []
+        smoothness_budget_camera_jobs = []
+        smoothness_budget_settings.clear()
+        for mesh in smoothness_budget_levels:
+            if cmds.objExists(mesh):
+                cmds.displaySmoothness(mesh, polygonObject=1)
+        smoothness_budget_cache.clear()
+        smoothness_budget_levels.clear()
+        print "Smoothness budget off"
+        return
+
+    smoothness_budget_settings["budget"] = budget
+    smoothness_budget_settings["maxLevel"] = maxLevel
+    update_smoothness_budget(requery=True)
+
+    # Camera changes are tracked by jobs installed on the active camera itself
+    smoothness_budget_jobs = [cmds.scriptJob(e=["SelectionChanged", lambda: update_smoothness_budget(requery=True)]),
+                              cmds.scriptJob(e=["modelEditorChanged", update_smoothness_budget])]
+    print "Smoothness budget on (%d polygons)" % budget
+
+'''
+Pure allocation for budget mode. Takes parallel lists of base polygon counts
+and screen sizes, and returns a list of smoothing levels. Each smoothing level
+quadruples an object's polygon count. Levels are handed out one level at a time,
+in order of decreasing screen size, for as long as the budget allows. Objects
+with no screen size (offscreen) are never smoothed, and don't count against
+the budget as they aren't drawn.
+'''
+def allocateSmoothnessLevels(poly_counts, screen_sizes, budget, max_level=3):
+    levels = [0] * len(poly_counts)
+    order = sorted((i for i in xrange(len(poly_counts)) if screen_sizes[i] > 0), key=lambda i: -screen_sizes[i])
+    total = sum(poly_counts[i] for i in order)
+
+    for level in xrange(1, max_level+1):
+        for i in order:
+            if levels[i] != level-1:
+                continue
+            extra = poly_counts[i] * (4**level - 4**(level-1))
+            if total + extra <= budget:
+                levels[i] = level
+                total += extra
+    return levels
+
 ''' Iterates between graph editor view modes (absolute, stacked, normalized) '''
 def iterGraphEditorView(dir):
     ordering = [(False, False),
@@ -109,3 +176,109 @@ def iter_ordering(ordering, m, dir):
         return ordering[0]
     n = len(ordering)
     return ordering[(ordering.index(m) + dir) % n]
+
+# Budget mode state
+smoothness_budget_settings = {}
+smoothness_budget_cache = {} # mesh -> (face count, bounding sphere center, bounding sphere radius)
+smoothness_budget_levels = {} # mesh -> currently applied smoothing level
+smoothness_budget_jobs = []
+smoothness_budget_camera_jobs = []
+
+def update_smoothness_budget(requery=False):
+    view = get_active_view()
+    if not view:
+        return
+    install_camera_jobs(view[0])
+
+    if requery:
+        meshes = cmds.ls(type="mesh", visible=1, noIntermediate=1, long=1) or []
+        current = set(meshes)
+        for mesh in smoothness_budget_cache.keys():
+            if mesh not in current:
+                del smoothness_budget_cache[mesh]
+                # Hidden meshes are unsmoothed, so they don't stay smoothed once budget mode is off
+                if smoothness_budget_levels.pop(mesh, None) and cmds.objExists(mesh):
+                    cmds.displaySmoothness(mesh, polygonObject=1)
+
+        # Only query meshes that are new, or selected (and so may have been edited)
+        dirty = set(mesh for mesh in meshes if mesh not in smoothness_budget_cache)
+        dirty.update(mesh for mesh in (cmds.ls(sl=1, dag=1, type="mesh", noIntermediate=1, long=1) or []) if mesh in current)
+        for mesh in dirty:
+            bb = cmds.exactWorldBoundingBox(mesh)
+            center = [(bb[i] + bb[i+3]) / 2.0 for i in xrange(3)]
+            radius = sum((bb[i+3] - bb[i])**2 for i in xrange(3))**.5 / 2.0
+            smoothness_budget_cache[mesh] = (cmds.polyEvaluate(mesh, face=1), center, radius)
+
+    meshes = smoothness_budget_cache.keys()
+    poly_counts = [smoothness_budget_cache[mesh][0] for mesh in meshes]
+    screen_sizes = [screen_size(smoothness_budget_cache[mesh][1], smoothness_budget_cache[mesh][2], *view[1:]) for mesh in meshes]
+    levels = allocateSmoothnessLevels(poly_counts, screen_sizes, smoothness_budget_settings["budget"], smoothness_budget_settings["maxLevel"])
+
+    # Only touch meshes whose level actually changed
+    for (mesh, level) in zip(meshes, levels):
+        if smoothness_budget_levels.get(mesh) == level:
+            continue
+        if level:
+            cmds.displaySmoothness(mesh, polygonObject=3)
+            cmds.setAttr(mesh + ".smoothLevel", level)
+        else:
+            cmds.displaySmoothness(mesh, polygonObject=1)
+        smoothness_budget_levels[mesh] = level
+
+def install_camera_jobs(cam):
+    global smoothness_budget_camera_jobs
+    if smoothness_budget_settings.get("camera") == cam and all(cmds.scriptJob(ex=job) for job in smoothness_budget_camera_jobs):
+        return
+
+    for job in smoothness_budget_camera_jobs:
+        if cmds.scriptJob(ex=job):
+            cmds.scriptJob(kill=job, force=1)
+    smoothness_budget_settings["camera"] = cam
+    cam_shape = cmds.listRelatives(cam, s=1, f=1)[0]
+    smoothness_budget_camera_jobs = [cmds.scriptJob(ac=[plug, update_smoothness_budget])
+                                     for plug in (cam + ".translate", cam + ".rotate",
+                                                  cam_shape + ".focalLength", cam_shape + ".orthographicWidth")]
+
+''' Returns (camera, world inverse matrix, horizontal scale, vertical scale, orthographic) for the active model panel '''
+def get_active_view():
+    panel = cmds.getPanel(wf=1)
+    if cmds.getPanel(to=panel) != "modelPanel":
+        panels = [p for p in (cmds.getPanel(vis=1) or []) if cmds.getPanel(to=p) == "modelPanel"]
+        if not panels:
+            return None
+        panel = panels[0]
+
+    cam = cmds.modelPanel(panel, q=1, cam=1)
+    if cmds.nodeType(cam) == "camera":
+        cam = cmds.listRelatives(cam, p=1, f=1)[0]
+    view_matrix = cmds.getAttr(cam + ".worldInverseMatrix[0]")
+
+    if cmds.camera(cam, q=1, o=1):
+        half_width = cmds.camera(cam, q=1, ow=1) / 2.0
+        return (cam, view_matrix, half_width, half_width / cmds.camera(cam, q=1, ar=1), True)
+
+    return (cam, view_matrix, math.tan(math.radians(cmds.camera(cam, q=1, hfv=1)) / 2.0),
+            math.tan(math.radians(cmds.camera(cam, q=1, vfv=1)) / 2.0), False)
+
+'''
+Approximate fraction of the screen width covered by a bounding sphere, or 0 if
+it lies outside the view frustum. Matrix is a flat, row-major maya matrix.
+'''
+def screen_size(center, radius, view_matrix, scale_h, scale_v, ortho=False):
+    m = view_matrix
+    x = center[0]*m[0] + center[1]*m[4] + center[2]*m[8] + m[12]
+    y = center[0]*m[1] + center[1]*m[5] + center[2]*m[9] + m[13]
+    z = center[0]*m[2] + center[1]*m[6] + center[2]*m[10] + m[14]
+
+    depth = -z # Cameras look down -z
+    if ortho:
+        (half_width, half_height) = (scale_h, scale_v)
+    else:
+        if depth + radius <= 0:
+            return 0.0
+        depth = max(depth, radius)
+        (half_width, half_height) = (depth * scale_h, depth * scale_v)
+
+    if abs(x) - radius > half_width or abs(y) - radius > half_height:
+        return 0.0
+    return radius / half_width